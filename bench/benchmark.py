@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+import PIL
+import converter
+from metrics import ConversionMetrics, RssSampler, peak_rss_kb_by_process
+import apkreader
+from mappingdb import load_mapping_db
+from transcode import run_plan, ENCODE_POLICIES
+import synthpack
+
+# Times every converter stage separately on a synthetic pack and writes the
+# results as JSON. Runs offline and needs nothing beyond Pillow.
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, func, *args, **kwargs):
+        times = os.times()
+        wall = time.perf_counter()
+        result = func(*args, **kwargs)
+        after = os.times()
+        self.stages[name] = {
+            "wall": round(time.perf_counter() - wall, 6),
+            "cpu": round((after.user + after.system) - (times.user + times.system), 6),
+            "children_cpu": round((after.children_user + after.children_system) - (times.children_user + times.children_system), 6),
+            "peak_rss_kb": peak_rss_kb_by_process()
+        }
+        return result
+
+def build_write_plan(available_files, appfilter_data, entries, icon_subfolder, places_subfolder, metrics, dedup_threshold, workers):
+    matches, remaining = converter.match_mappings(available_files, appfilter_data, entries, metrics)
+    return converter.plan_jobs(matches, remaining, available_files, icon_subfolder, places_subfolder, metrics, None, dedup_threshold, workers)
+
+def run_benchmark(args, work_dir):
+    mapping_db = load_mapping_db(args.config)
+    timer = StageTimer()
+
+    entries = timer.run("generate", synthpack.build_pack, args.drawables, args.components, args.collisions,
+                        args.prefixes, seed=args.seed, packages=list(mapping_db.entries), size_scale=args.size_scale)
+    apk_path = os.path.join(work_dir, "synthetic.apk")
+    tree_dir = os.path.join(work_dir, "decoded")
+    synthpack.write_apk(entries, apk_path)
+    synthpack.write_tree(entries, tree_dir)
+    del entries
+
+    if args.source == "apk":
+        variants = timer.run("index", apkreader.index_apk_images, apk_path)
+        appfilter_data = apkreader.read_appfilter(apk_path)
+    else:
+        variants = timer.run("index", converter.index_all_images, tree_dir)
+        with open(os.path.join(tree_dir, "assets", "appfilter.xml"), "rb") as f:
+            appfilter_data = f.read()
+    available_files = converter.select_sources(variants, converter.TARGET_SIZE)
+
+    timer.run("appfilter", converter.parse_appfilter, appfilter_data, {})
+
+    theme_root = os.path.join(work_dir, "output", "Synthetic")
+    icon_subfolder = os.path.join(theme_root, "apps", "512x512")
+    places_subfolder = os.path.join(theme_root, "places", "512x512")
+    os.makedirs(icon_subfolder)
+    os.makedirs(places_subfolder)
+    converter.generate_index_theme("Synthetic", theme_root, "hicolor")
+
+    levels = converter.size_levels(theme_root, converter.theme_sizes(None))
+
+    metrics = ConversionMetrics()
+    plan = timer.run("match", build_write_plan, available_files, appfilter_data, mapping_db.entries,
+                     icon_subfolder, places_subfolder, metrics, args.dedup, args.workers)
+    # With --encode-policy all every policy encodes the same plan into emptied
+    # folders, so their CPU time and output size can be compared directly.
+    policies = ENCODE_POLICIES if args.encode_policy == "all" else [args.encode_policy]
+    encode_policies = {}
+    for policy in policies:
+        for folder in (icon_subfolder, places_subfolder):
+            shutil.rmtree(folder)
+            os.makedirs(folder)
+        policy_metrics = ConversionMetrics()
+        stage = "encode" if len(policies) == 1 else f"encode_{policy}"
+        with RssSampler() as sampler:
+            written, failures = timer.run(stage, run_plan, plan, args.workers, args.link_mode, policy_metrics, None, policy,
+                                          levels, args.memory_budget * 1024 * 1024 if args.memory_budget else None)
+        encode_policies[policy] = {
+            "wall": timer.stages[stage]["wall"],
+            "encode_cpu": round(policy_metrics.encode_time, 6),
+            "encode_cpu_by_kind": {k: round(v, 6) for k, v in policy_metrics.encode_time_by_kind.items()},
+            "bytes_written": policy_metrics.bytes_written,
+            "images_decoded": policy_metrics.images_decoded,
+            "images_passed_through": policy_metrics.images_passed_through,
+            "encode_rss_kb": sampler.peak_kb,
+            "worker_rss_kb": policy_metrics.worker_rss_kb
+        }
+        timer.stages[stage]["peak_rss_kb"] = peak_rss_kb_by_process(policy_metrics.worker_rss_kb)
+    first = encode_policies[policies[0]]
+
+    install_base = os.path.join(work_dir, "icons")
+    timer.run("install", converter.install_theme, theme_root, "Synthetic", install_base)
+    apkreader.close_archive(apk_path)
+
+    return {
+        "params": {
+            "drawables": args.drawables,
+            "components": args.components,
+            "collisions": args.collisions,
+            "prefixes": args.prefixes,
+            "seed": args.seed,
+            "size_scale": args.size_scale,
+            "source": args.source,
+            "workers": args.workers,
+            "link_mode": args.link_mode,
+            "encode_policy": args.encode_policy,
+            "dedup": args.dedup,
+            "memory_budget_mb": args.memory_budget
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count()
+        },
+        "stages": timer.stages,
+        "match_phases": {k: round(v["wall"], 6) for k, v in metrics.phases.items()},
+        "encode_policies": encode_policies,
+        "dedup": metrics.dedup,
+        "counts": {
+            "variants": sum(len(v) for v in variants.values()),
+            "drawables": len(available_files),
+            "jobs": len(plan),
+            "written": written,
+            "failures": len(failures),
+            "stats": metrics.counts,
+            "images_decoded": first["images_decoded"],
+            "bytes_written": first["bytes_written"],
+            "encode_time": first["encode_cpu"]
+        },
+        "peak_rss_kb": peak_rss_kb_by_process(max(p["worker_rss_kb"] or 0 for p in encode_policies.values()))
+    }
+
+def compare(previous, current):
+    print(f"{'stage':<18}{'before':>10}{'after':>10}{'change':>10}")
+    rows = [(name, previous["stages"].get(name, {}).get("wall"), stage["wall"]) for name, stage in current["stages"].items()]
+    rows += [(name, previous.get("match_phases", {}).get(name), value) for name, value in current["match_phases"].items()]
+    for name, before, after in rows:
+        if before is None:
+            print(f"{name:<18}{'-':>10}{after:>10.3f}{'':>10}")
+        else:
+            change = f"{(after - before) / before * 100:+.1f}%" if before else ""
+            print(f"{name:<18}{before:>10.3f}{after:>10.3f}{change:>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the converter on a synthetic icon pack.")
+    parser.add_argument("--drawables", type=int, default=3000)
+    parser.add_argument("--components", type=int, default=2000)
+    parser.add_argument("--collisions", type=float, default=0.3)
+    parser.add_argument("--prefixes", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size-scale", type=int, default=1, help="multiply icon sizes, e.g. 8 for 1536px xxxhdpi sources")
+    parser.add_argument("--source", choices=["apk", "tree"], default="apk", help="index the APK directly or a decoded tree")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--link-mode", choices=["symlink", "hardlink", "copy"], default="symlink")
+    parser.add_argument("--encode-policy", choices=ENCODE_POLICIES + ["all"], default="default",
+                        help="encoding policy, or all to encode once with each and compare")
+    parser.add_argument("--memory-budget", type=int, metavar="MB", help="run the encoders memory-bounded with this budget")
+    parser.add_argument("--dedup", type=int, metavar="THRESHOLD", help="merge duplicate leftover drawables with this threshold")
+    parser.add_argument("--config", default=os.path.join(synthpack.SRC_DIR, "Config"))
+    parser.add_argument("--output", help="write the results JSON to this file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="isomorphicon-bench-")
+    try:
+        results = run_benchmark(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), results)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
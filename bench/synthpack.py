@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import zipfile
+from PIL import Image, ImageDraw
+
+# Builds synthetic icon packs for benchmarking: a decoded apktool-style tree
+# and/or an APK with res/drawable-* images and assets/appfilter.xml.
+# Everything is derived from the seed, so the same parameters give the same pack.
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src")
+
+DENSITY_SIZES = {
+    "drawable": 192,
+    "drawable-mdpi": 48,
+    "drawable-hdpi": 72,
+    "drawable-xhdpi": 96,
+    "drawable-xxhdpi": 144,
+    "drawable-xxxhdpi": 192,
+    "drawable-xxhdpi-v26": 144,
+    "drawable-nodpi": 512,
+}
+
+PREFIXES = ["ic_", "icon_", "app_", "launcher_"]
+WORDS = ["photo", "music", "mail", "chat", "map", "note", "clock", "camera", "files", "game",
+         "store", "video", "radio", "book", "shop", "wallet", "health", "cloud", "code", "paint"]
+
+def load_packages(mappings_path):
+    with open(mappings_path, "r") as f:
+        mappings = json.load(f)
+    return [k for k in mappings if k != "__COMMENT__"]
+
+def drawable_names(rng, packages, count, prefix_ratio):
+    names = []
+    seen = set()
+    while len(names) < count:
+        if packages and rng.random() < 0.5:
+            base = rng.choice(packages).split(".")[-1].replace("-", "_").lower()
+        else:
+            base = "_".join(rng.sample(WORDS, rng.randint(1, 2)))
+        if rng.random() < prefix_ratio:
+            base = rng.choice(PREFIXES) + base
+        name = base
+        n = 2
+        while name in seen:
+            name = f"{base}_{n}"
+            n += 1
+        seen.add(name)
+        names.append(name)
+    return names
+
+def render_icon(rng, size):
+    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    color = tuple(rng.randint(0, 255) for _ in range(3)) + (255,)
+    draw.ellipse([size // 16, size // 16, size - size // 16, size - size // 16], fill=color)
+    for _ in range(3):
+        x0, y0 = rng.randint(0, size // 2), rng.randint(0, size // 2)
+        x1, y1 = x0 + rng.randint(size // 8, size // 2), y0 + rng.randint(size // 8, size // 2)
+        draw.rectangle([x0, y0, x1, y1], fill=tuple(rng.randint(0, 255) for _ in range(3)) + (255,))
+    return img
+
+def encode(img, fmt):
+    buf = io.BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()
+
+def build_pack(drawables=500, components=400, collision_ratio=0.3, prefix_ratio=0.3,
+               webp_ratio=0.2, seed=0, packages=None, size_scale=1):
+    # Returns {entry name: bytes}, the same layout as inside an APK.
+    # size_scale multiplies every density's icon size.
+    rng = random.Random(seed)
+    packages = packages or []
+    names = drawable_names(rng, packages, drawables, prefix_ratio)
+    folders = list(DENSITY_SIZES)
+    entries = {}
+
+    for name in names:
+        # Collisions put the same drawable name into several density folders.
+        count = rng.randint(2, 4) if rng.random() < collision_ratio else 1
+        img = None
+        for folder in rng.sample(folders, count):
+            size = DENSITY_SIZES[folder] * size_scale
+            if img is None or img.width < size: img = render_icon(rng, size)
+            ext, fmt = ("webp", "WEBP") if rng.random() < webp_ratio else ("png", "PNG")
+            entries[f"res/{folder}/{name}.{ext}"] = encode(img.resize((size, size)), fmt)
+
+    lines = ['<?xml version="1.0" encoding="utf-8"?>', "<resources>"]
+    for i in range(components):
+        pkg = rng.choice(packages) if packages and rng.random() < 0.7 else f"com.synthetic.app{i}"
+        lines.append(f'    <item component="ComponentInfo{{{pkg}/{pkg}.MainActivity}}" drawable="{rng.choice(names)}" />')
+    lines.append('    <iconback img1="iconback" />')
+    lines.append('    <scale factor="0.85" />')
+    lines.append("</resources>")
+    entries["assets/appfilter.xml"] = "\n".join(lines).encode("utf-8")
+    return entries
+
+def write_tree(entries, out_dir):
+    for entry, data in entries.items():
+        path = os.path.join(out_dir, *entry.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    return out_dir
+
+def write_apk(entries, apk_path):
+    # aapt stores PNGs uncompressed; mirror that so zip reads behave like real packs.
+    with zipfile.ZipFile(apk_path, "w") as z:
+        z.writestr("AndroidManifest.xml", b"\0" * 16, zipfile.ZIP_DEFLATED)
+        for entry, data in entries.items():
+            method = zipfile.ZIP_DEFLATED if entry.endswith(".xml") else zipfile.ZIP_STORED
+            z.writestr(entry, data, method)
+    return apk_path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Android icon pack.")
+    parser.add_argument("--drawables", type=int, default=500)
+    parser.add_argument("--components", type=int, default=400)
+    parser.add_argument("--collisions", type=float, default=0.3, help="share of names present in several folders")
+    parser.add_argument("--prefixes", type=float, default=0.3, help="share of names with an ic_/icon_/... prefix")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size-scale", type=int, default=1, help="multiply icon sizes, e.g. 8 for 1536px xxxhdpi sources")
+    parser.add_argument("--mappings", default=os.path.join(SRC_DIR, "Config", "mappings.json"))
+    parser.add_argument("--apk", help="write the pack as an APK to this path")
+    parser.add_argument("--tree", help="write the pack as a decoded tree to this folder")
+    args = parser.parse_args(argv)
+
+    if not args.apk and not args.tree:
+        parser.error("give --apk and/or --tree")
+
+    packages = load_packages(args.mappings) if os.path.exists(args.mappings) else []
+    entries = build_pack(args.drawables, args.components, args.collisions, args.prefixes, seed=args.seed, packages=packages, size_scale=args.size_scale)
+    if args.apk: write_apk(entries, args.apk)
+    if args.tree: write_tree(entries, args.tree)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,10 @@
 import json
+import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mappingdb import load_mapping_db
+
 def merge_duplicates(pairs):
     d = {}
     for k, v in pairs:
@@ -28,5 +32,9 @@ try:
         json.dump(data, f, indent=4)
         
     print(f"✅ ¡Éxito! Archivo guardado como {output_filename}")
+
+    # Regenera el índice compilado que usa el conversor
+    load_mapping_db(os.path.dirname(os.path.abspath(output_filename)))
+    print("✅ Índice compilado regenerado")
 except Exception as e:
     print(f"❌ Error: {e}")
\ No newline at end of file
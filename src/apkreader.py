@@ -0,0 +1,116 @@
+import io
+import os
+import threading
+import zipfile
+from PIL import Image
+
+# Images inside an APK are addressed as "<apk path>!/<entry name>", the same
+# way jar URLs do it, so they can flow through the index and write plan as
+# plain strings next to files decoded by apktool.
+ZIP_SEPARATOR = "!/"
+
+DENSITY_PRIORITIES = ["ldpi", "mdpi", "tvdpi", "hdpi", "xhdpi", "xxhdpi", "xxxhdpi", "nodpi"]
+IMAGE_EXTENSIONS = (".png", ".webp")
+
+# Open archives and how many conversions hold each one. The GUI and the
+# D-Bus service can convert the same APK in one process at the same time, so
+# an archive is only closed once its last holder is done with it.
+_archives = {}
+_archive_refs = {}
+_archives_pid = None
+_archives_lock = threading.Lock()
+
+def density_rank(folder):
+    # Qualifiers are matched whole, so "hdpi" never picks up "xxhdpi-v26".
+    for qualifier in folder.split("-")[1:]:
+        if qualifier in DENSITY_PRIORITIES:
+            return DENSITY_PRIORITIES.index(qualifier)
+    return -1
+
+def sort_drawable_dirs(all_dirs):
+    drawable_dirs = [d for d in all_dirs if d.split("-")[0] == "drawable"]
+    return sorted(drawable_dirs, key=lambda d: (density_rank(d), d))
+
+def reset_after_fork():
+    # Forked pool workers must not share the parent's file offsets.
+    global _archives_pid
+    if _archives_pid != os.getpid():
+        _archives.clear()
+        _archive_refs.clear()
+        _archives_pid = os.getpid()
+
+def get_archive(apk_path):
+    with _archives_lock:
+        reset_after_fork()
+        if apk_path not in _archives:
+            _archives[apk_path] = zipfile.ZipFile(apk_path)
+        return _archives[apk_path]
+
+def hold_archive(apk_path):
+    # Takes a reference for a conversion; the archive itself is still opened
+    # on first read. Every hold_archive needs a matching close_archive.
+    with _archives_lock:
+        reset_after_fork()
+        _archive_refs[apk_path] = _archive_refs.get(apk_path, 0) + 1
+
+def close_archive(apk_path):
+    with _archives_lock:
+        refs = _archive_refs.get(apk_path, 0) - 1
+        if refs > 0:
+            _archive_refs[apk_path] = refs
+            return
+        _archive_refs.pop(apk_path, None)
+        archive = _archives.pop(apk_path, None)
+    if archive: archive.close()
+
+def is_zip_source(source):
+    return ZIP_SEPARATOR in source
+
+def open_source(source):
+    if not is_zip_source(source): return source
+    apk_path, entry = source.split(ZIP_SEPARATOR, 1)
+    return io.BytesIO(get_archive(apk_path).read(entry))
+
+def read_source(source):
+    if not is_zip_source(source):
+        with open(source, "rb") as f:
+            return f.read()
+    apk_path, entry = source.split(ZIP_SEPARATOR, 1)
+    return get_archive(apk_path).read(entry)
+
+def read_image_size(source):
+    # Image.open only parses the header; pixel data is never decoded here.
+    try:
+        if is_zip_source(source):
+            apk_path, entry = source.split(ZIP_SEPARATOR, 1)
+            with get_archive(apk_path).open(entry) as f, Image.open(f) as img:
+                return img.size
+        with Image.open(source) as img:
+            return img.size
+    except Exception:
+        return (0, 0)
+
+def add_variant(variants, f, source):
+    name = os.path.splitext(f)[0].lower()
+    width, height = read_image_size(source)
+    variants.setdefault(name, []).append((source, width, height))
+
+def index_apk_images(apk_path):
+    folders = {}
+    for entry in get_archive(apk_path).namelist():
+        parts = entry.split("/")
+        if len(parts) != 3 or parts[0] != "res": continue
+        if not parts[2].endswith(IMAGE_EXTENSIONS): continue
+        folders.setdefault(parts[1], []).append(parts[2])
+
+    variants = {}
+    for folder in sort_drawable_dirs(list(folders)):
+        for f in folders[folder]:
+            add_variant(variants, f, f"{apk_path}{ZIP_SEPARATOR}res/{folder}/{f}")
+    return variants
+
+def read_appfilter(apk_path):
+    try:
+        return get_archive(apk_path).read("assets/appfilter.xml")
+    except KeyError:
+        return None
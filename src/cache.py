@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import tempfile
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "isomorphicon")
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def hash_json(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+def store_data(cache_path, data):
+    # Written under a temporary name first so concurrent workers never
+    # expose a half-written entry.
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        os.replace(tmp_path, cache_path)
+    except:
+        if os.path.exists(tmp_path): os.unlink(tmp_path)
+        raise
+
+def sized_path(cache_path, chain):
+    # Entry holding a downscaled copy of a PNG entry. Each size is scaled from
+    # the one before it, so chain lists every size from the largest down to
+    # this one and different size lists never share an entry.
+    return f"{os.path.splitext(cache_path)[0]}-{'-'.join(str(size) for size in chain)}.png"
+
+class ConversionCache:
+    # Entries are content addressed: the drawable index and encoded PNGs by the
+    # APK's SHA-256, match plans by the APK, mappings and synonyms hashes.
+    # Reads bump the mtime so evict() can drop the least recently used files.
+
+    def __init__(self, root=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def entry_path(self, kind, key, ext):
+        return os.path.join(self.root, kind, key[:2], f"{key}{ext}")
+
+    def touch(self, path):
+        try: os.utime(path)
+        except OSError: pass
+
+    def load_json(self, kind, key):
+        path = self.entry_path(kind, key, ".json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.touch(path)
+        return data
+
+    def store_json(self, kind, key, data):
+        # Best effort: an unwritable cache only costs the next run its reuse.
+        path = self.entry_path(kind, key, ".json")
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Cannot write {kind} cache entry: {e}")
+            if tmp_path and os.path.exists(tmp_path): os.unlink(tmp_path)
+            return False
+        return True
+
+    def png_path(self, apk_hash, source_key, normalize, policy="default", size=None):
+        # size is the largest size folder, when it isn't the usual 512.
+        key = f"{apk_hash}\0{source_key}\0{int(normalize)}"
+        if policy != "default": key += f"\0{policy}"
+        if size: key += f"\0{size}"
+        key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.entry_path("png", key, ".png")
+
+    def plan_key(self, apk_hash, mapping_digest, version=0):
+        return hash_json([apk_hash, version, mapping_digest])
+
+    def evict(self):
+        entries = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for f in filenames:
+                path = os.path.join(dirpath, f)
+                try: st = os.stat(path)
+                except OSError: continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        removed = 0
+        for mtime, size, path in entries:
+            if total <= self.max_bytes: break
+            try:
+                os.unlink(path)
+                total -= size
+                removed += 1
+            except OSError: pass
+        return removed
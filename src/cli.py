@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Headless entry point: never imports gi, so it runs in CI without a display.
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "share", "isomorphicon"))
+sys.path.append('/app/share/isomorphicon')
+
+import converter
+import targeting
+from cache import ConversionCache
+from mappingdb import load_mapping_db, default_config_dir
+from metrics import ConversionMetrics, PROFILERS
+from transcode import ENCODE_POLICIES
+from dedup import DEFAULT_THRESHOLD
+from matchplan import PLAN_SUFFIX, plan_path, save_plan, load_plan, diff_plans, format_diff
+
+DEFAULT_INHERITS = "breeze-dark,breeze,Adwaita,hicolor"
+
+def find_apks(inputs):
+    # Match plans given by name are kept too; directories only yield APKs.
+    apks = []
+    for path in inputs:
+        if os.path.isdir(path):
+            apks.extend(sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(".apk")))
+        else:
+            apks.append(path)
+    return apks
+
+def assign_theme_names(apks, plans=None):
+    names = {}
+    used = set()
+    for apk in apks:
+        if plans and apk in plans: base = plans[apk]["theme"]
+        else: base = converter.theme_name_from_apk(apk) or "theme"
+        name = base
+        n = 2
+        while name in used:
+            name = f"{base}_{n}"
+            n += 1
+        used.add(name)
+        names[apk] = name
+    return names
+
+def convert_one(apk_path, mapping_db, output, theme_name, options, match_plan=None):
+    start = time.monotonic()
+    # Converter diagnostics go to stderr so stdout stays machine readable.
+    with contextlib.redirect_stdout(sys.stderr):
+        result, metrics = converter.convert_apk(
+            match_plan["apk"] if match_plan else apk_path,
+            mapping_db.mappings,
+            mapping_db.synonyms,
+            output,
+            theme_name,
+            options["inherits"],
+            install=options["install"],
+            workers=options["workers"],
+            link_mode=options["link_mode"],
+            encode_policy=options["encode_policy"],
+            dedup_threshold=options["dedup_threshold"],
+            sync=options["sync"],
+            sizes=options["sizes"],
+            wanted=options["wanted"],
+            memory_budget=options["memory_budget"],
+            backend=options["backend"],
+            cache=ConversionCache() if options["cache"] else None,
+            mapping_db=mapping_db,
+            metrics=ConversionMetrics(options["profile"], options["profiler"]),
+            match_plan=match_plan
+        )
+    return {
+        "apk": apk_path,
+        "theme": theme_name,
+        "status": "ok" if result else "failed",
+        "output": result,
+        "seconds": round(time.monotonic() - start, 3),
+        "stats": metrics.counts,
+        "metrics": metrics.to_dict()
+    }
+
+def dry_run_one(apk_path, mapping_db, output, theme_name, options, compare_path=None):
+    # Writes <output>/<theme>.plan.json and diffs it against the plan it replaces.
+    start = time.monotonic()
+    path = plan_path(output, theme_name)
+    compare_path = compare_path or path
+    previous = None
+    if os.path.exists(compare_path):
+        try: previous = load_plan(compare_path)
+        except (OSError, ValueError) as e: print(f"Ignoring previous plan: {e}", file=sys.stderr)
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            plan = converter.dry_run_apk(apk_path, mapping_db, theme_name, options["backend"],
+                                         ConversionCache() if options["cache"] else None)
+    except Exception as e:
+        print(f"Error matching {apk_path}: {e}", file=sys.stderr)
+        return {"apk": apk_path, "theme": theme_name, "status": "failed", "output": None,
+                "seconds": round(time.monotonic() - start, 3), "stats": ConversionMetrics().counts}
+    save_plan(plan, path)
+    return {
+        "apk": apk_path,
+        "theme": theme_name,
+        "status": "ok",
+        "output": path,
+        "seconds": round(time.monotonic() - start, 3),
+        "stats": plan["stats"],
+        "diff": diff_plans(previous, plan) if previous else None
+    }
+
+def print_summary(results):
+    for r in results:
+        s = r["stats"]
+        matched = s["XML_MATCH"] + s["DIRECT_EXACT_MATCH"] + s["DIRECT_PREFIX_MATCH"] + s["SCORED_MATCH"]
+        encode = ""
+        if r.get("metrics"):
+            m = r["metrics"]
+            encode = f", {m['bytes_written'] / 1e6:.1f} MB in {m['encode_time']:.1f}s CPU ({m['encode_policy']})"
+            if m.get("dedup"):
+                encode += f", {m['dedup']['exact_duplicates'] + m['dedup']['near_duplicates']} duplicates merged"
+        print(f"{r['status'].upper():6} {r['theme']}: {matched} matched, {s['FAILED']} unmatched{encode}, "
+              f"{r['seconds']:.1f}s -> {r['output'] or '-'}")
+        if r.get("diff"):
+            for line in format_diff(r["diff"]): print(line)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="isomorphicon-cli", description="Convert Android icon packs to Linux icon themes.")
+    parser.add_argument("inputs", nargs="+", help=f"APK files, directories containing APKs or {PLAN_SUFFIX} files to execute")
+    parser.add_argument("-o", "--output", default=os.path.join(os.path.expanduser("~"), "Isomorphicon_Output"),
+                        help="folder the themes are written to")
+    parser.add_argument("--inherits", default=DEFAULT_INHERITS, help="comma-separated parent themes")
+    parser.add_argument("--install", action="store_true", help="install the themes to ~/.local/share/icons")
+    parser.add_argument("--sync", action="store_true",
+                        help="update an existing theme in place, writing only icons that changed")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of packs converted at the same time")
+    parser.add_argument("--workers", type=int, default=None, help="encoding processes per pack (default: CPUs / jobs)")
+    parser.add_argument("--link-mode", choices=["symlink", "hardlink", "copy"], default="symlink")
+    parser.add_argument("--backend", choices=["auto", "zip", "apktool"], default="auto")
+    parser.add_argument("--encode-policy", choices=ENCODE_POLICIES, default="default",
+                        help="passthrough copies PNGs that need no conversion, fast favours speed, size favours small files")
+    parser.add_argument("--sizes", action="append", metavar="[CATEGORY=]SIZES",
+                        help="icon sizes to write, e.g. 32,48,64,128,256,512; repeat with places=512 to skip the small folder icons (default: 512)")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="decode large icons at reduced size and at most this many MB of pixels at once across workers")
+    parser.add_argument("--installed-apps", action="store_true",
+                        help="only write the icons that desktop files of installed apps (XDG and Flatpak) use")
+    parser.add_argument("--keep-all", dest="installed_apps", action="store_false",
+                        help="write every mapped target and leftover drawable (default)")
+    parser.add_argument("--dedup", action="store_true", help="merge identical and similar leftover drawables")
+    parser.add_argument("--dedup-threshold", type=int, default=DEFAULT_THRESHOLD,
+                        help="differing perceptual hash bits still counted as a duplicate (0-256)")
+    parser.add_argument("--config", default=default_config_dir(),
+                        help="folder holding mappings.json and synonyms.json")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="disable the conversion cache")
+    parser.add_argument("--dry-run", action="store_true",
+                        help=f"only match, writing <output>/<theme>{PLAN_SUFFIX} and the coverage change since the last plan")
+    parser.add_argument("--compare-plan", metavar="PLAN", help="plan to compare a single dry run against")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    parser.add_argument("--profile", metavar="PHASE", help="profile one phase (e.g. scored_match, encode)")
+    parser.add_argument("--profiler", choices=PROFILERS, default="cprofile")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    apks = find_apks(args.inputs)
+    if not apks:
+        print("No APK files found.", file=sys.stderr)
+        return 2
+
+    plans = {}
+    for path in apks:
+        if not path.endswith(PLAN_SUFFIX): continue
+        try:
+            plans[path] = load_plan(path)
+        except (OSError, ValueError) as e:
+            print(f"Cannot read plan {path}: {e}", file=sys.stderr)
+            return 2
+    if plans and args.dry_run:
+        print("Match plans can't be dry run again; pass the APK instead.", file=sys.stderr)
+        return 2
+    if args.compare_plan and len(apks) != 1:
+        print("--compare-plan needs exactly one APK.", file=sys.stderr)
+        return 2
+
+    try:
+        sizes = converter.parse_sizes(args.sizes)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    wanted = None
+    if args.installed_apps and not args.dry_run:
+        wanted = targeting.installed_icon_names()
+        if not wanted:
+            print("No installed apps found; pass --keep-all to write every icon.", file=sys.stderr)
+            return 2
+
+    try:
+        mapping_db = load_mapping_db(args.config)
+    except (OSError, ValueError) as e:
+        print(f"Cannot load mappings from {args.config}: {e}", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+
+    jobs = max(1, min(args.jobs, len(apks)))
+    options = {
+        "inherits": args.inherits,
+        "install": args.install,
+        "workers": args.workers or max(1, (os.cpu_count() or 1) // jobs),
+        "link_mode": args.link_mode,
+        "encode_policy": args.encode_policy,
+        "dedup_threshold": args.dedup_threshold if args.dedup else None,
+        "sync": args.sync,
+        "sizes": sizes,
+        "wanted": wanted,
+        "memory_budget": args.memory_budget * 1024 * 1024 if args.memory_budget else None,
+        "backend": args.backend,
+        "cache": args.cache,
+        "profile": args.profile,
+        "profiler": args.profiler
+    }
+    theme_names = assign_theme_names(apks, plans)
+
+    results = []
+    if args.dry_run:
+        for apk in apks:
+            results.append(dry_run_one(apk, mapping_db, args.output, theme_names[apk], options, args.compare_plan))
+    elif jobs == 1:
+        for apk in apks:
+            results.append(convert_one(apk, mapping_db, args.output, theme_names[apk], options, plans.get(apk)))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(convert_one, apk, mapping_db, args.output, theme_names[apk], options, plans.get(apk)): apk
+                for apk in apks
+            }
+            for future in as_completed(futures):
+                apk = futures[future]
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"Error converting {apk}: {e}", file=sys.stderr)
+                    results.append({"apk": apk, "theme": theme_names[apk], "status": "failed", "output": None,
+                                    "seconds": 0, "stats": ConversionMetrics().counts})
+        results.sort(key=lambda r: apks.index(r["apk"]))
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(results)
+
+    return 0 if all(r["status"] == "ok" for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,81 +1,487 @@
 import os
+import errno
 import shutil
 import subprocess
 import xml.etree.ElementTree as ET
-from PIL import Image
-import difflib
-import re
+import io
+import tempfile
+import zipfile
+from apkreader import sort_drawable_dirs, add_variant, index_apk_images, read_appfilter, get_archive, hold_archive, close_archive, is_zip_source, IMAGE_EXTENSIONS, ZIP_SEPARATOR
+from cache import hash_file, hash_json
+from iconcache import write_icon_cache
+from mappingdb import MappingDB
+from metrics import ConversionMetrics, RssSampler, peak_rss_kb_by_process
+from progress import ProgressTracker, ConversionCancelled
+from matchindex import MatchIndex, STRIP_PREFIXES, strip_name, tokenize, score_prepared
+from transcode import make_job, with_cache_path, run_plan, run_pipeline, dedupe_plan
+from sync import ThemeSync
+from dedup import dedupe_jobs
+from targeting import prune_jobs, prune_matches
+
+TARGET_SIZE = 512
+# Icon categories and their index.theme Context.
+ICON_CATEGORIES = {"apps": "Applications", "places": "Places"}
+INDEX_VERSION = 2
+PLAN_VERSION = 1
+
+def convert_apk(apk_path, mappings, synonyms, output_base_folder, theme_name, inherits_list, install=False, workers=None, link_mode="symlink", backend="auto", cache=None, mapping_db=None, metrics=None, progress=None, install_base=None, encode_policy="default", dedup_threshold=None, match_plan=None, sync=False, sizes=None, wanted=None, memory_budget=None):
+    # Returns (output path or None, ConversionMetrics). A cancelled or failed
+    # conversion returns None and leaves the previous theme untouched. dedup_threshold
+    # enables merging duplicate leftover drawables (see dedup.py). A match_plan
+    # from dry_run_apk replaces indexing and matching. With sync the existing
+    # theme (the installed one when installing) is updated in place and only
+    # changed icons are written; see sync.py. sizes ({category: [sizes]}, see
+    # parse_sizes) adds smaller size folders next to the 512px ones. wanted, a
+    # set of icon names (see targeting.py), limits the theme to those targets;
+    # None writes every target and leftover drawable. memory_budget (bytes)
+    # makes encoding memory-bounded, see transcode.py.
+    if metrics is None: metrics = ConversionMetrics()
+    if progress is None: progress = ProgressTracker()
+    if mapping_db is None: mapping_db = MappingDB(mappings, synonyms)
+    metrics.encode_policy = encode_policy
+    metrics.memory_budget = memory_budget
+    if wanted is not None: metrics.wanted_names = len(wanted)
+
+    theme_base = output_base_folder
+    if install:
+        if install_base is None: install_base = default_install_base()
+        os.makedirs(install_base, exist_ok=True)
+        theme_base = install_base
+    if sync:
+        theme_root = os.path.join(theme_base, theme_name)
+    else:
+        # Build the theme next to its final place so putting it there is a
+        # rename, and a cancelled run never touches the previous output.
+        os.makedirs(theme_base, exist_ok=True)
+        collect_install_leftovers(theme_base, theme_name)
+        theme_root = install_staging_path(theme_base, theme_name)
+        if os.path.exists(theme_root): shutil.rmtree(theme_root)
+    # The staging folder is removed on failure; a synced theme never is.
+    scratch_root = not sync
+    sizes = theme_sizes(sizes)
+    levels = size_levels(theme_root, sizes)
+    icon_subfolder = size_folder(theme_root, "apps", sizes["apps"][0])
+    places_subfolder = size_folder(theme_root, "places", sizes["places"][0])
 
-STATS = {
-    "XML_MATCH": 0,
-    "DIRECT_EXACT_MATCH": 0,
-    "DIRECT_PREFIX_MATCH": 0,
-    "SCORED_MATCH": 0,
-    "FAILED": 0
-}
+    temp_dir = os.path.join(output_base_folder, f"_temp_apktool_{theme_name}")
 
-def convert_apk(apk_path, mappings, synonyms, output_base_folder, theme_name, inherits_list, install=False):
-    for k in STATS: STATS[k] = 0
+    if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
+    for folders in levels.values():
+        for size, folder in folders: os.makedirs(folder, exist_ok=True)
 
-    if not shutil.which("apktool"):
-        print("Error: 'apktool' is not installed or not in PATH.")
-        return None
+    generate_index_theme(theme_name, theme_root, inherits_list, sizes)
+    theme_sync = ThemeSync(theme_root) if sync else None
 
-    theme_root = os.path.join(output_base_folder, theme_name)
-    icon_subfolder = os.path.join(theme_root, "apps", "512x512")
-    places_subfolder = os.path.join(theme_root, "places", "512x512")
+    hold_archive(apk_path)
+    try:
+        cached_plan = None
+        if match_plan is not None:
+            apk_hash = hash_file(apk_path)
+            if apk_hash != match_plan["apk_hash"]:
+                raise RuntimeError("the APK changed since the match plan was made.")
+            backend_used = match_plan["backend"]
+            available_files = {name: resolve_source(key, apk_path, temp_dir, backend_used) for name, key in match_plan["sources"].items()}
+            if backend_used == "apktool" and not cache:
+                progress.report("extract", 0, 1)
+                with metrics.phase("extract"):
+                    run_apktool(apk_path, temp_dir, progress)
+            metrics.counts.update(match_plan["stats"])
+            metrics.appfilter = match_plan.get("appfilter")
+        else:
+            available_files, appfilter_data, backend_used, apk_hash = load_index(apk_path, temp_dir, backend, cache, metrics, progress)
+
+        if cache and match_plan is None:
+            plan_digest = mapping_db.digest or hash_json([mappings, synonyms])
+            if dedup_threshold is not None: plan_digest = f"{plan_digest}:dedup{dedup_threshold}"
+            if sizes != theme_sizes(None): plan_digest = f"{plan_digest}:sizes{hash_json(sizes)}"
+            if wanted is not None: plan_digest = f"{plan_digest}:wanted{hash_json(sorted(wanted))}"
+            plan_key = cache.plan_key(apk_hash, plan_digest, INDEX_VERSION)
+            cached_plan = cache.load_json("plan", plan_key)
+            # Plans cached before match records were kept can't feed the results view.
+            if cached_plan and "matches" not in cached_plan: cached_plan = None
+
+        # A fresh plan streams into the encoders while matching runs. Sync
+        # needs the whole plan first, and so does an apktool tree that may have
+        # to be decoded again.
+        pipelined = match_plan is None and not cached_plan and not theme_sync and (backend_used != "apktool" or os.path.exists(temp_dir))
+        if match_plan is not None:
+            write_plan = plan_jobs(match_plan["matches"], match_plan["remaining"], available_files, icon_subfolder, places_subfolder, metrics, progress, dedup_threshold, workers, wanted)
+            metrics.matches = match_plan["matches"]
+        elif cached_plan:
+            write_plan = [
+                make_job(resolve_source(key, apk_path, temp_dir, backend_used), os.path.join(theme_root, folder), names, normalize)
+                for key, folder, names, normalize in cached_plan["jobs"]
+            ]
+            metrics.counts.update(cached_plan["stats"])
+            metrics.dedup = cached_plan.get("dedup")
+            metrics.appfilter = cached_plan.get("appfilter")
+            metrics.matches = cached_plan["matches"]
+        elif pipelined:
+            def produce(emit):
+                if cache:
+                    send = emit
+                    emit = lambda job: send(with_cache_path(job, cache.png_path(apk_hash, source_key(job[0], temp_dir), job[3], encode_policy, cache_size(levels, job[1]))))
+                return stream_write_plan(available_files, appfilter_data, mapping_db.entries, icon_subfolder, places_subfolder, emit, metrics, progress, dedup_threshold, workers, wanted)
+
+            # "pipeline" is matching and encoding overlapped; run_pipeline
+            # records the "produce" and "encode" phases within it.
+            with metrics.phase("pipeline"), RssSampler() as sampler:
+                (metrics.matches, write_plan), written, failures = run_pipeline(produce, workers, link_mode, metrics, progress, encode_policy, levels, memory_budget)
+            metrics.encode_rss_kb = sampler.peak_kb
+        else:
+            matches, remaining = match_mappings(available_files, appfilter_data, mapping_db.entries, metrics, progress)
+            write_plan = plan_jobs(matches, remaining, available_files, icon_subfolder, places_subfolder, metrics, progress, dedup_threshold, workers, wanted)
+            metrics.matches = matches
+        if wanted is not None and not cached_plan: metrics.matches = prune_matches(metrics.matches, wanted)
+
+        if cache and match_plan is None and not cached_plan:
+            cache.store_json("plan", plan_key, {
+                "jobs": [[source_key(job[0], temp_dir), os.path.relpath(job[1], theme_root), job[2], job[3]] for job in write_plan],
+                "stats": dict(metrics.counts),
+                "dedup": metrics.dedup,
+                "appfilter": metrics.appfilter,
+                "matches": metrics.matches
+            })
+
+        relinks = []
+        if theme_sync:
+            with metrics.phase("sync"):
+                write_plan = dedupe_plan(write_plan)
+                if apk_hash is None: apk_hash = hash_file(apk_path)
+                fingerprints = {job[0]: source_fingerprint(job[0], apk_hash, temp_dir) for job in write_plan}
+                write_plan, relinks = theme_sync.plan(write_plan, fingerprints, encode_policy, link_mode, levels)
+            metrics.sync = theme_sync.stats
+
+        if cache and not pipelined:
+            write_plan = [with_cache_path(job, cache.png_path(apk_hash, source_key(job[0], temp_dir), job[3], encode_policy, cache_size(levels, job[1]))) for job in write_plan]
+            # A cached index from an apktool run points into a temp tree that is gone;
+            # only decode again if some output is missing from the cache.
+            if backend_used == "apktool" and not os.path.exists(temp_dir):
+                if any(not os.path.exists(job[4]) for job in write_plan):
+                    progress.report("extract", 0, 1)
+                    with metrics.phase("extract"):
+                        run_apktool(apk_path, temp_dir, progress)
+
+        if not pipelined:
+            with metrics.phase("encode"), RssSampler() as sampler:
+                written, failures = run_plan(write_plan, workers, link_mode, metrics, progress, encode_policy, levels, memory_budget)
+            metrics.encode_rss_kb = sampler.peak_kb
+        if theme_sync:
+            failures += theme_sync.relink(relinks, link_mode)
+            theme_sync.commit(failures)
+            s = theme_sync.stats
+            print(f"Sync: {s['written']} written, {s['relinked']} relinked, {s['unchanged']} unchanged, {s['removed']} removed.")
+        metrics.write_failures = len(failures)
+        if wanted is not None: print(f"Wrote only the icons installed apps use ({written} files for {len(wanted)} names).")
+        for target_path, error in failures:
+            print(f"Failed to write {target_path}: {error}")
+        if cache: cache.evict()
+        if metrics.dedup and metrics.dedup["groups"]:
+            d = metrics.dedup
+            print(f"Merged {d['exact_duplicates']} identical and {d['near_duplicates']} similar drawables "
+                  f"into {d['groups']} icons, saving {d['bytes_saved']} source bytes.")
+
+        with metrics.phase("icon_cache"):
+            write_icon_cache(theme_root)
 
-    temp_dir = os.path.join(output_base_folder, f"_temp_apktool_{theme_name}")
+        final_output_path = theme_root
 
-    if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
-    os.makedirs(icon_subfolder, exist_ok=True)
-    os.makedirs(places_subfolder, exist_ok=True)
+        if install and not sync:
+            progress.check()
+            progress.report("install", 0, 1)
+            with metrics.phase("install"):
+                final_output_path = install_theme(theme_root, theme_name, install_base)
+        elif not sync:
+            progress.check()
+            final_output_path = install_theme(theme_root, theme_name, output_base_folder)
+
+        return final_output_path, metrics
+
+    except ConversionCancelled:
+        print("Conversion cancelled.")
+        if theme_sync: theme_sync.abort()
+        return None, metrics
+    except subprocess.CalledProcessError as e:
+        print(f"Error: Apktool failed.\nSTDOUT:\n{e.stdout}\nSTDERR:\n{e.stderr}")
+        return None, metrics
+    except Exception as e:
+        print(f"Error: {e}")
+        return None, metrics
+    finally:
+        close_archive(apk_path)
+        metrics.peak_rss_kb = peak_rss_kb_by_process(metrics.worker_rss_kb)
+        # Only left behind if the conversion or the swap failed.
+        if scratch_root and os.path.exists(theme_root): shutil.rmtree(theme_root, ignore_errors=True)
+        if os.path.exists(temp_dir):
+            try: shutil.rmtree(temp_dir)
+            except: pass
 
-    generate_index_theme(theme_name, theme_root, inherits_list)
+def load_index(apk_path, temp_dir, backend="auto", cache=None, metrics=None, progress=None):
+    # Returns (available_files, appfilter_data, backend_used, apk_hash); apk_hash is None without a cache.
+    if metrics is None: metrics = ConversionMetrics()
+    if progress is None: progress = ProgressTracker()
+    apk_hash = hash_file(apk_path) if cache else None
+    cached_index = cache.load_json("index", apk_hash) if cache else None
+    if cached_index and cached_index.get("version") != INDEX_VERSION: cached_index = None
+
+    if cached_index:
+        backend_used = cached_index["backend"]
+        variants = {
+            name: [(resolve_source(key, apk_path, temp_dir, backend_used), w, h) for key, w, h in entries]
+            for name, entries in cached_index["files"]
+        }
+        appfilter_data = cached_index["appfilter"]
+        # Stored as latin-1 text so the raw bytes survive the JSON round trip.
+        if appfilter_data is not None: appfilter_data = appfilter_data.encode("latin-1")
+    else:
+        variants, appfilter_data, backend_used = load_drawables(apk_path, temp_dir, backend, metrics, progress)
+        if cache:
+            cache.store_json("index", apk_hash, {
+                "version": INDEX_VERSION,
+                "backend": backend_used,
+                "files": [[name, [[source_key(path, temp_dir), w, h] for path, w, h in entries]] for name, entries in variants.items()],
+                "appfilter": appfilter_data.decode("latin-1") if appfilter_data is not None else None
+            })
+
+    progress.check()
+    with metrics.phase("index"):
+        available_files = select_sources(variants, TARGET_SIZE)
+    return available_files, appfilter_data, backend_used, apk_hash
+
+def dry_run_apk(apk_path, mapping_db, theme_name=None, backend="auto", cache=None, metrics=None, progress=None):
+    # Runs only indexing and matching and returns a JSON-serializable match
+    # plan: one entry per mapping with its phase, drawable, score and targets,
+    # plus the leftover drawables. No image is decoded or written, and
+    # convert_apk(match_plan=...) can execute the plan later.
+    if metrics is None: metrics = ConversionMetrics()
+    if theme_name is None: theme_name = theme_name_from_apk(apk_path)
+    temp_dir = tempfile.mkdtemp(prefix="isomorphicon-plan-")
+    hold_archive(apk_path)
+    try:
+        available_files, appfilter_data, backend_used, apk_hash = load_index(apk_path, temp_dir, backend, cache, metrics, progress)
+        matches, remaining = match_mappings(available_files, appfilter_data, mapping_db.entries, metrics, progress)
+        used = [m["drawable"] for m in matches if m["drawable"]] + remaining
+        return {
+            "version": PLAN_VERSION,
+            "apk": os.path.abspath(apk_path),
+            "apk_hash": apk_hash or hash_file(apk_path),
+            "theme": theme_name,
+            "backend": backend_used,
+            "mapping_digest": mapping_db.digest,
+            "stats": dict(metrics.counts),
+            "appfilter": metrics.appfilter,
+            "matches": matches,
+            "remaining": remaining,
+            "sources": {name: source_key(available_files[name], temp_dir) for name in used}
+        }
+    finally:
+        close_archive(apk_path)
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
+def theme_name_from_apk(apk_path):
+    theme_name = os.path.splitext(os.path.basename(apk_path))[0]
+    return "".join([c if c.isalnum() else "_" for c in theme_name]).strip("_")
+
+def run_apktool(apk_path, temp_dir, progress=None):
+    if not shutil.which("apktool"):
+        raise RuntimeError("'apktool' is not installed or not in PATH.")
+    cmd = ["apktool", "d", apk_path, "-o", temp_dir, "-f", "-s"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # Poll instead of blocking so a cancel can stop a long decode.
+    while True:
+        try:
+            stdout, stderr = proc.communicate(timeout=0.2)
+            break
+        except subprocess.TimeoutExpired:
+            if progress and progress.cancelled:
+                proc.kill()
+                proc.communicate()
+                raise ConversionCancelled()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+
+def load_drawables(apk_path, temp_dir, backend="auto", metrics=None, progress=None):
+    if metrics is None: metrics = ConversionMetrics()
+    if progress is None: progress = ProgressTracker()
+    if backend != "apktool":
+        try:
+            progress.report("index", 0, 1)
+            with metrics.phase("index"):
+                variants = index_apk_images(apk_path)
+            if variants:
+                return variants, read_appfilter(apk_path), "zip"
+        except zipfile.BadZipFile as e:
+            print(f"Could not read APK directly: {e}")
+
+    # Obfuscated resource paths need resources.arsc decoded by apktool.
+    if backend == "zip":
+        raise RuntimeError("no drawables found in the APK.")
+    progress.report("extract", 0, 1)
+    with metrics.phase("extract"):
+        run_apktool(apk_path, temp_dir, progress)
+
+    appfilter_data = None
+    appfilter_path = os.path.join(temp_dir, "assets", "appfilter.xml")
+    if os.path.exists(appfilter_path):
+        with open(appfilter_path, "rb") as f:
+            appfilter_data = f.read()
+    progress.report("index", 0, 1)
+    with metrics.phase("index"):
+        variants = index_all_images(temp_dir)
+    return variants, appfilter_data, "apktool"
+
+def source_fingerprint(source, apk_hash, temp_dir):
+    # Zip entries carry a CRC; files of an apktool tree can only be tied to the APK they came from.
+    if is_zip_source(source):
+        apk_path, entry = source.split(ZIP_SEPARATOR, 1)
+        info = get_archive(apk_path).getinfo(entry)
+        return f"{info.CRC:08x}:{info.file_size}"
+    return f"{apk_hash}:{source_key(source, temp_dir)}"
+
+def source_key(source, temp_dir):
+    if is_zip_source(source): return source.split(ZIP_SEPARATOR, 1)[1]
+    return os.path.relpath(source, temp_dir)
+
+def resolve_source(key, apk_path, temp_dir, backend_used):
+    if backend_used == "zip": return f"{apk_path}{ZIP_SEPARATOR}{key}"
+    return os.path.join(temp_dir, key)
+
+def default_install_base():
+    return os.path.join(os.path.expanduser("~"), ".local", "share", "icons")
+
+def install_staging_path(install_base, theme_name):
+    return os.path.join(install_base, f".{theme_name}.staging-{os.getpid()}")
+
+def collect_install_leftovers(install_base, theme_name):
+    # Staging and old trees of runs that died before cleaning up after themselves.
+    prefixes = (f".{theme_name}.staging-", f".{theme_name}.old-")
+    try: names = os.listdir(install_base)
+    except OSError: return
+    for name in names:
+        if not name.startswith(prefixes): continue
+        pid = name.rsplit("-", 1)[1]
+        if pid.isdigit() and pid_alive(int(pid)): continue
+        shutil.rmtree(os.path.join(install_base, name), ignore_errors=True)
+
+def pid_alive(pid):
+    if pid == os.getpid(): return True
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: return True
+    return True
+
+def install_theme(theme_root, theme_name, install_base=None):
+    # Swaps the theme in with renames, so the previous install stays usable
+    # until the new one is complete and nothing is copied when theme_root
+    # is already on the same filesystem.
+    if install_base is None: install_base = default_install_base()
+    install_dest = os.path.join(install_base, theme_name)
+    os.makedirs(install_base, exist_ok=True)
+
+    staging = install_staging_path(install_base, theme_name)
+    if os.path.abspath(theme_root) != os.path.abspath(staging):
+        if os.path.exists(staging): shutil.rmtree(staging)
+        try:
+            os.rename(theme_root, staging)
+        except OSError as e:
+            if e.errno != errno.EXDEV: raise
+            shutil.copytree(theme_root, staging, symlinks=True)
+            shutil.rmtree(theme_root)
+
+    old = None
+    if os.path.lexists(install_dest):
+        old = os.path.join(install_base, f".{theme_name}.old-{os.getpid()}")
+        if os.path.lexists(old): shutil.rmtree(old)
+        os.rename(install_dest, old)
     try:
-        subprocess.run(
-            ["apktool", "d", apk_path, "-o", temp_dir, "-f", "-s"],
-            check=True, capture_output=True, text=True
-        )
-        available_files = index_all_images(temp_dir)
-
-        processed_linux_names = set()
-        processed_packages = set()
-        total_mapped = 0
-        appfilter_path = os.path.join(temp_dir, "assets", "appfilter.xml")
-
-        if os.path.exists(appfilter_path):
-            try:
-                tree = ET.parse(appfilter_path)
-                items = tree.getroot().findall('item')
-                package_candidates = {}
-
-                for item in items:
-                    drawable_name = item.get('drawable')
-                    component_raw = item.get('component')
-                    if not drawable_name or not component_raw: continue
-
-                    resource_name = os.path.basename(drawable_name).replace("@drawable/", "").strip()
-                    package_name = parse_component(component_raw)
-
-                    if package_name not in package_candidates:
-                        package_candidates[package_name] = []
-
-                    if resource_name not in package_candidates[package_name]:
-                        package_candidates[package_name].append(resource_name)
-                for pkg, linux_targets in mappings.items():
-                    if pkg == "__COMMENT__": continue
+        os.rename(staging, install_dest)
+    except OSError:
+        if old: os.rename(old, install_dest)
+        raise
+
+    if old: shutil.rmtree(old, ignore_errors=True)
+    return install_dest
+
+APPFILTER_IMAGE_TAGS = ["iconback", "iconmask", "iconupon"]
+
+def parse_appfilter(appfilter_data, extras=None):
+    # Streams the XML so a 10k item appfilter never becomes a full tree.
+    # Candidates are dicts used as insertion-ordered sets. When given, extras
+    # is filled with the calendar, iconback/iconmask/iconupon and scale entries.
+    package_candidates = {}
+    if extras is not None:
+        extras.setdefault("calendar", {})
+        for tag in APPFILTER_IMAGE_TAGS: extras.setdefault(tag, [])
+        extras.setdefault("scale", None)
+
+    root = None
+    for event, elem in ET.iterparse(io.BytesIO(appfilter_data), events=("start", "end")):
+        if event == "start":
+            if root is None: root = elem
+            continue
+        if elem is root: break
+
+        tag = elem.tag
+        if tag == "item":
+            drawable_name = elem.get('drawable')
+            component_raw = elem.get('component')
+            if drawable_name and component_raw:
+                resource_name = os.path.basename(drawable_name).replace("@drawable/", "").strip()
+                package_name = parse_component(component_raw)
+                package_candidates.setdefault(package_name, {})[resource_name] = None
+        elif extras is not None:
+            if tag == "calendar":
+                component_raw = elem.get('component')
+                if component_raw and elem.get('prefix'):
+                    extras["calendar"][parse_component(component_raw)] = elem.get('prefix')
+            elif tag in APPFILTER_IMAGE_TAGS:
+                extras[tag].extend(v for k, v in elem.attrib.items() if k.startswith("img") and v)
+            elif tag == "scale":
+                try: extras["scale"] = float(elem.get('factor'))
+                except (TypeError, ValueError): pass
+
+        # Drop handled elements from the root as well, otherwise it keeps them all.
+        elem.clear()
+        if elem in root: root.remove(elem)
+    return package_candidates
+
+def match_record(pkg, entry, phase, drawable, score, targets):
+    return {"package": pkg, "phase": phase, "drawable": drawable, "score": score, "targets": list(targets), "category": entry["category"]}
+
+def match_mappings(available_files, appfilter_data, entries, metrics=None, progress=None, on_match=None):
+    # Runs the XML, direct and scored phases on drawable names only. Returns
+    # (matches, remaining): one record per mapping in write plan order, and the
+    # drawables left for collect_remaining_icons. Failed records keep the best
+    # candidate below the threshold in "drawable" so it can be inspected.
+    # on_match(record) is called for every successful match as it is found.
+    if metrics is None: metrics = ConversionMetrics()
+    if progress is None: progress = ProgressTracker()
+
+    with metrics.phase("match_index"):
+        match_index = MatchIndex(available_files)
+        names_by_path = {path: name for name, path in available_files.items()}
+
+    processed_linux_names = set()
+    processed_packages = set()
+    matches = []
+
+    if appfilter_data is not None:
+        try:
+            with metrics.phase("xml_parse"):
+                metrics.appfilter = {}
+                package_candidates = parse_appfilter(appfilter_data, metrics.appfilter)
 
+            with metrics.phase("xml_match"):
+                for pkg, entry in entries.items():
                     if pkg in package_candidates:
                         candidates = package_candidates[pkg]
-                        criteria = generate_criteria(pkg, linux_targets, synonyms)
 
                         best_candidate_name = None
                         best_candidate_score = -1
 
                         for cand_name in candidates:
-                            score = calculate_file_score(cand_name, criteria)
+                            clean_name = strip_name(cand_name)
+                            score = score_prepared(clean_name, tokenize(clean_name), entry["prepared"])
 
                             if score > best_candidate_score:
                                 best_candidate_score = score
@@ -86,234 +492,163 @@ def convert_apk(apk_path, mappings, synonyms, output_base_folder, theme_name, in
                                     best_candidate_name = cand_name
 
                         if best_candidate_name and best_candidate_name in available_files:
-                            target_names, category = get_target_info(pkg, mappings)
-                            dest_folder = places_subfolder if category == "places" else icon_subfolder
+                            target_names = entry["targets"]
 
-                            count = save_one_source_to_many(available_files[best_candidate_name], dest_folder, target_names)
-
-                            if count > 0:
-                                total_mapped += count
-                                STATS["XML_MATCH"] += 1
+                            if target_names:
+                                matches.append(match_record(pkg, entry, "XML_MATCH", best_candidate_name, best_candidate_score, target_names))
+                                metrics.count("XML_MATCH")
+                                if on_match: on_match(matches[-1])
                                 for t in target_names: processed_linux_names.add(t)
                                 processed_packages.add(pkg)
 
-            except Exception as e:
-                print(f"Error parsing XML: {e}")
-
-        for key_source, targets in mappings.items():
-            if key_source == "__COMMENT__": continue
-            if key_source in processed_packages: continue
-            target_list = targets if isinstance(targets, list) else [targets]
-            missing_targets = [t for t in target_list if t not in processed_linux_names]
-
-            if not missing_targets: continue
-            wanted_names = generate_criteria(key_source, target_list, synonyms)
-            match_found = False
-            best_file_path = None
-            for wanted in wanted_names:
-                wanted = wanted.lower()
+        except Exception as e:
+            print(f"Error parsing XML: {e}")
+
+    total = len(entries)
+    for done, (key_source, entry) in enumerate(entries.items()):
+        if done % 64 == 0:
+            progress.check()
+            progress.report("match", done, total)
+        if key_source in processed_packages: continue
+        missing_targets = [t for t in entry["targets"] if t not in processed_linux_names]
+
+        if not missing_targets: continue
+        wanted_names = entry["criteria"]
+        phase = None
+        best_name = None
+        with metrics.phase("direct_match"):
+            for wanted, acronym in entry["prepared"]:
                 if wanted in available_files:
-                    best_file_path = available_files[wanted]
-                    STATS["DIRECT_EXACT_MATCH"] += 1
-                    match_found = True
+                    best_name = wanted
+                    phase = "DIRECT_EXACT_MATCH"
                     break
-            if not match_found:
-                prefixes = ["ic_", "icon_", "app_", "launcher_"]
+        if not phase:
+            with metrics.phase("prefix_match"):
                 for wanted in wanted_names:
-                    for pre in prefixes:
+                    for pre in STRIP_PREFIXES:
                         candidate = f"{pre}{wanted}"
                         if candidate in available_files:
-                            best_file_path = available_files[candidate]
-                            STATS["DIRECT_PREFIX_MATCH"] += 1
-                            match_found = True
+                            best_name = candidate
+                            phase = "DIRECT_PREFIX_MATCH"
                             break
-                    if match_found: break
-            if not match_found:
-                best_score = 0
-
-                for fname, fpath in available_files.items():
-                    score = calculate_file_score(fname, wanted_names)
-
-                    if score > best_score:
-                        best_score = score
-                        best_file_path = fpath
-                    elif score == best_score and score > 0:
-                        if len(fname) < len(os.path.basename(best_file_path)):
-                            best_file_path = fpath
-
-                if best_score >= 50:
-                    STATS["SCORED_MATCH"] += 1
-                    match_found = True
-                else:
-                    best_file_path = None
-            if match_found and best_file_path:
-                is_place = key_source.startswith("resource_folder")
-                dest_dir = places_subfolder if is_place else icon_subfolder
-
-                success = save_one_source_to_many(best_file_path, dest_dir, missing_targets)
-                if success > 0:
-                    total_mapped += success
-                    for t in missing_targets: processed_linux_names.add(t)
-            else:
-                STATS["FAILED"] += 1
-
-        extra_count = collect_remaining_icons(available_files, icon_subfolder, processed_linux_names)
-
-        final_output_path = theme_root
-
-        if install:
-            try:
-                install_base = os.path.join(os.path.expanduser("~"), ".local", "share", "icons")
-                install_dest = os.path.join(install_base, theme_name)
-
-                if not os.path.exists(install_base):
-                    os.makedirs(install_base)
-
-                if os.path.exists(install_dest):
-                    shutil.rmtree(install_dest)
-
-                shutil.move(theme_root, install_dest)
-                final_output_path = install_dest
-            except Exception as e:
-                print(f"Install failed: {e}")
-
-        return final_output_path
-
-    except subprocess.CalledProcessError as e:
-        print(f"Error: Apktool failed.\nSTDOUT:\n{e.stdout}\nSTDERR:\n{e.stderr}")
-        return None
-    except Exception as e:
-        print(f"Error: {e}")
-        return None
-    finally:
-        if os.path.exists(temp_dir):
-            try: shutil.rmtree(temp_dir)
-            except: pass
-
-def generate_criteria(key_source, target_list, synonyms):
-    criteria = []
-
-    if "." in key_source:
-        criteria.append(key_source.replace(".", "_"))
-        parts = key_source.split('.')
-        if len(parts) > 1:
-            last = parts[-1]
-            if last not in ["android", "app", "mobile"]:
-                criteria.append(last)
-    else:
-        criteria.append(key_source)
-
-    if synonyms and key_source in synonyms:
-        criteria.extend(synonyms[key_source])
-
-    if key_source.startswith("resource_"):
-        criteria.append(key_source.replace("resource_", ""))
-
-    for t in target_list:
-        clean_t = t.replace("org.", "").replace("com.", "").replace("kde.", "").replace("-", "_")
-        if "." in clean_t: clean_t = clean_t.split(".")[-1]
-        criteria.append(clean_t)
-
-    return criteria
-
-def calculate_file_score(filename, wanted_list):
-    filename = filename.lower()
-    clean_fname = filename
-    for p in ["ic_", "icon_", "app_", "launcher_"]:
-        clean_fname = clean_fname.replace(p, "")
-
-    max_s = 0
-
-    for wanted in wanted_list:
-        wanted = wanted.lower()
-        score = 0
-
-        if clean_fname == wanted:
-            score = 1000
-
+                    if phase: break
+        if phase:
+            clean_name = strip_name(best_name)
+            best_score = score_prepared(clean_name, tokenize(clean_name), entry["prepared"])
         else:
-            tokens = clean_fname.replace("-", "_").split("_")
-            if wanted in tokens:
-                penalty = (len(tokens) - 1) * 20
-                score = 800 - penalty
-
-            else:
-                parts = wanted.replace("-", "_").split("_")
-                acronym = "".join([p[0] for p in parts]) if len(parts) > 1 else ""
-                if acronym and clean_fname == acronym:
-                    score = 600
-
-                elif clean_fname.startswith(wanted):
-                    score = 500
-
-                elif wanted in clean_fname:
-                      ratio = len(wanted) / len(clean_fname)
-                      score = int(100 * ratio)
-                      if not clean_fname.startswith(wanted): score -= 10
-
-        if score > max_s: max_s = score
-    return max_s
-
-def get_target_info(package_name, mappings):
-    if package_name in mappings:
-        val = mappings[package_name]
-        category = "places" if package_name.startswith("resource_folder") else "apps"
-        targets = val if isinstance(val, list) else [val]
-        return targets, category
-    return [], "apps"
-
-def save_one_source_to_many(source_path, dest_folder, target_names):
-    count = 0
-    try:
-        with Image.open(source_path) as img:
-            img.load()
-            if img.mode != 'RGBA': base_img = img.convert('RGBA')
-            else: base_img = img.copy()
-
-            for name in target_names:
-                try:
-                    target_path = os.path.join(dest_folder, f"{name}.png")
-                    base_img.save(target_path, "PNG")
-                    count += 1
-                except: pass
-    except: return 0
-    return count
+            with metrics.phase("scored_match"):
+                best_file_path, best_score = match_index.best_match_prepared(entry["prepared"])
+            best_name = names_by_path.get(best_file_path)
+            if best_score >= 50: phase = "SCORED_MATCH"
+
+        if phase and best_name:
+            metrics.count(phase)
+            matches.append(match_record(key_source, entry, phase, best_name, best_score, missing_targets))
+            for t in missing_targets: processed_linux_names.add(t)
+            if on_match: on_match(matches[-1])
+        else:
+            metrics.count("FAILED")
+            matches.append(match_record(key_source, entry, "FAILED", best_name, best_score, missing_targets))
+
+    progress.report("match", total, total)
+    remaining = [name for name in available_files if name not in processed_linux_names]
+    return matches, remaining
+
+def plan_jobs(matches, remaining, available_files, icon_subfolder, places_subfolder, metrics=None, progress=None, dedup_threshold=None, workers=None, wanted=None):
+    write_plan = [match_job(match, available_files, icon_subfolder, places_subfolder) for match in matches if match["phase"] != "FAILED"]
+    if wanted is not None: write_plan = prune_jobs(write_plan, wanted)
+    write_plan.extend(leftover_jobs(remaining, available_files, icon_subfolder, metrics, progress, dedup_threshold, workers, wanted))
+    return write_plan
+
+def match_job(match, available_files, icon_subfolder, places_subfolder):
+    dest_folder = places_subfolder if match["category"] == "places" else icon_subfolder
+    return make_job(available_files[match["drawable"]], dest_folder, match["targets"])
+
+def leftover_jobs(remaining, available_files, icon_subfolder, metrics=None, progress=None, dedup_threshold=None, workers=None, wanted=None):
+    if metrics is None: metrics = ConversionMetrics()
+    if wanted is not None: remaining = [name for name in remaining if name in wanted]
+    with metrics.phase("collect_remaining_icons"):
+        leftovers = collect_remaining_icons({name: available_files[name] for name in remaining}, icon_subfolder, set())
+    if dedup_threshold is not None and leftovers:
+        with metrics.phase("dedup"):
+            leftovers, metrics.dedup = dedupe_jobs(leftovers, dedup_threshold, workers, progress)
+    return leftovers
+
+def stream_write_plan(available_files, appfilter_data, entries, icon_subfolder, places_subfolder, emit, metrics=None, progress=None, dedup_threshold=None, workers=None, wanted=None):
+    # match_mappings and plan_jobs for run_pipeline: every job goes to emit() as soon as
+    # its mapping resolves, the leftover drawables once matching is over.
+    # Returns (matches, write_plan).
+    write_plan = []
+    xml_jobs = []
+
+    def add(jobs):
+        if wanted is not None: jobs = prune_jobs(jobs, wanted)
+        write_plan.extend(jobs)
+        for job in jobs: emit(job)
+
+    def on_match(match):
+        # Appfilter matches may share targets, the later one winning; they
+        # are only sent once that phase is over. Later phases skip targets
+        # that are already taken.
+        job = match_job(match, available_files, icon_subfolder, places_subfolder)
+        if match["phase"] == "XML_MATCH":
+            xml_jobs.append(job)
+            return
+        if xml_jobs: add(dedupe_plan(xml_jobs))
+        xml_jobs.clear()
+        add([job])
+
+    matches, remaining = match_mappings(available_files, appfilter_data, entries, metrics, progress, on_match)
+    add(dedupe_plan(xml_jobs))
+    add(leftover_jobs(remaining, available_files, icon_subfolder, metrics, progress, dedup_threshold, workers, wanted))
+    return matches, write_plan
+
+def select_sources(variants, target_size):
+    # Smallest variant that still covers the target size, otherwise the largest
+    # one. Equal sizes keep the later, higher density folder.
+    files_map = {}
+    for name, entries in variants.items():
+        best = None
+        for entry in entries:
+            if best is None:
+                best = entry
+                continue
+            big_enough = min(entry[1], entry[2]) >= target_size
+            best_big_enough = min(best[1], best[2]) >= target_size
+            area, best_area = entry[1] * entry[2], best[1] * best[2]
+            if big_enough and (not best_big_enough or area <= best_area):
+                best = entry
+            elif not big_enough and not best_big_enough and area >= best_area:
+                best = entry
+        files_map[name] = best[0]
+    return files_map
 
 def index_all_images(base_temp_dir):
-    files_map = {}
+    variants = {}
     res_path = os.path.join(base_temp_dir, "res")
     if not os.path.exists(res_path): return {}
-    priorities = ["mdpi", "hdpi", "xhdpi", "xxhdpi", "xxxhdpi", "nodpi"]
     all_dirs = []
     try: all_dirs = os.listdir(res_path)
     except: return {}
 
-    sorted_dirs = [d for d in all_dirs if "drawable" in d and not any(p in d for p in priorities)]
-    for p in priorities:
-        sorted_dirs.extend([d for d in all_dirs if "drawable" in d and p in d])
+    sorted_dirs = sort_drawable_dirs(all_dirs)
 
     for folder in sorted_dirs:
         folder_path = os.path.join(res_path, folder)
         try:
             for f in os.listdir(folder_path):
-                if f.endswith(".png") or f.endswith(".webp"):
-                    name = os.path.splitext(f)[0].lower()
-                    files_map[name] = os.path.join(folder_path, f)
+                if f.endswith(IMAGE_EXTENSIONS):
+                    add_variant(variants, f, os.path.join(folder_path, f))
         except: pass
-    return files_map
+    return variants
 
 def collect_remaining_icons(available_files, output_folder, already_processed):
-    count = 0
+    jobs = []
     for name, source_path in available_files.items():
         if name in already_processed: continue
-        try:
-            with Image.open(source_path) as img:
-                target_path = os.path.join(output_folder, f"{name}.png")
-                img.save(target_path, "PNG")
-                already_processed.add(name)
-                count += 1
-        except: pass
-    return count
+        jobs.append(make_job(source_path, output_folder, [name], normalize=False))
+        already_processed.add(name)
+    return jobs
 
 def parse_component(raw_component):
     try:
@@ -321,22 +656,64 @@ def parse_component(raw_component):
     except:
         return raw_component
 
-def generate_index_theme(theme_name, theme_root, inherits_list):
+def parse_sizes(specs):
+    # Each spec is a comma-separated list of sizes, for every category or, as
+    # "places=64,512", for one. Returns {category: sizes} or None when empty.
+    sizes = {}
+    shared = None
+    for spec in specs or []:
+        category, _, values = spec.rpartition("=")
+        if category and category not in ICON_CATEGORIES:
+            raise ValueError(f"Unknown icon category '{category}', expected one of {list(ICON_CATEGORIES)}")
+        try:
+            values = [int(v) for v in values.split(",") if v.strip()]
+        except ValueError:
+            raise ValueError(f"Invalid size list '{spec}'")
+        if not values or min(values) < 1: raise ValueError(f"Invalid size list '{spec}'")
+        if category: sizes[category] = values
+        else: shared = values
+    if shared is None and not sizes: return None
+    return {category: sizes.get(category, shared or [TARGET_SIZE]) for category in ICON_CATEGORIES}
+
+def theme_sizes(sizes):
+    # Sizes per category, largest first; the largest is where the jobs write.
+    sizes = sizes or {}
+    return {category: sorted(set(sizes.get(category) or [TARGET_SIZE]), reverse=True) for category in ICON_CATEGORIES}
+
+def size_folder(theme_root, category, size):
+    return os.path.join(theme_root, category, f"{size}x{size}")
+
+def size_levels(theme_root, sizes):
+    # Maps each category's largest folder to its (size, folder) list for run_plan.
+    return {
+        size_folder(theme_root, category, values[0]): [(size, size_folder(theme_root, category, size)) for size in values]
+        for category, values in sizes.items()
+    }
+
+def cache_size(levels, dest_folder):
+    size = levels[dest_folder][0][0] if dest_folder in levels else TARGET_SIZE
+    return size if size != TARGET_SIZE else None
+
+def generate_index_theme(theme_name, theme_root, inherits_list, sizes=None):
+    sizes = theme_sizes(sizes)
+    directories = [(f"{category}/{size}x{size}", size, context) for category, context in ICON_CATEGORIES.items() for size in sizes[category]]
     content = f"""[Icon Theme]
 Name={theme_name}
 Comment=Converted with Isomorphicon
 Inherits={inherits_list}
-Directories=apps/512x512,places/512x512
-
-[apps/512x512]
-Size=512
-Context=Applications
-Type=Fixed
-
-[places/512x512]
-Size=512
-Context=Places
+Directories={",".join(d for d, size, context in directories)}
+"""
+    for directory, size, context in directories:
+        content += f"""
+[{directory}]
+Size={size}
+Context={context}
 Type=Fixed
 """
-    with open(os.path.join(theme_root, "index.theme"), "w") as f:
+    # Left alone when unchanged so a synced theme isn't touched needlessly.
+    path = os.path.join(theme_root, "index.theme")
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            if f.read() == content: return
+    with open(path, "w") as f:
         f.write(content)
@@ -0,0 +1,181 @@
+import hashlib
+import io
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from apkreader import read_source
+from transcode import make_job, default_workers, pool_context
+from progress import ProgressTracker
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Groups leftover drawables that are byte-identical or look the same, so only
+# one file per group is encoded and the other names are linked to it.
+# The perceptual hash is a difference hash: each bit says whether a pixel of
+# a HASH_SIZE x (HASH_SIZE + 1) grayscale thumbnail is brighter than its left
+# neighbour. Two drawables are near-duplicates when their hashes differ in at
+# most `threshold` bits and their average colors are close, since the hash
+# alone can't tell a red square from a blue one. NumPy makes hashing and
+# comparing much faster but is optional; without it the same hashes are
+# computed in plain Python.
+
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+DEFAULT_THRESHOLD = 8
+HASH_CHUNK = 32
+COMPARE_BLOCK = 1024
+COLOR_TOLERANCE = 12
+
+def thumbnail_source(source):
+    # Returns (sha256, source bytes, pixel area, thumbnail luminance, average RGB);
+    # the last two are None when the image can't be decoded.
+    data = read_source(source)
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            area = img.width * img.height
+            if img.mode not in ("RGB", "RGBA"): img = img.convert("RGBA")
+            thumb = img.resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX, reducing_gap=2.0).convert("RGBA")
+    except Exception:
+        return digest, len(data), 0, None, None
+    # Transparent pixels carry arbitrary colors; flatten onto gray first.
+    background = Image.new("RGBA", thumb.size, (128, 128, 128, 255))
+    flat = Image.alpha_composite(background, thumb)
+    color = flat.resize((1, 1), Image.BOX).getpixel((0, 0))[:3]
+    return digest, len(data), area, flat.convert("L").tobytes(), color
+
+def thumbnail_chunk(sources):
+    return [thumbnail_source(source) for source in sources]
+
+def difference_hashes(thumbs):
+    if numpy is not None:
+        pixels = numpy.frombuffer(b"".join(thumbs), dtype=numpy.uint8).reshape(len(thumbs), HASH_SIZE, HASH_SIZE + 1)
+        bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+        packed = numpy.packbits(bits.reshape(len(thumbs), HASH_BITS), axis=1)
+        return [int.from_bytes(row.tobytes(), "big") for row in packed]
+
+    hashes = []
+    for thumb in thumbs:
+        value = 0
+        for y in range(HASH_SIZE):
+            row = thumb[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+            for x in range(HASH_SIZE):
+                value = (value << 1) | (row[x + 1] > row[x])
+        hashes.append(value)
+    return hashes
+
+def near_pairs(hashes, colors, threshold):
+    # Yields (i, j) with i < j for every pair within the threshold.
+    if numpy is not None:
+        color_array = numpy.array(colors, dtype=numpy.int16).reshape(len(colors), 3)
+        packed = b"".join(h.to_bytes(HASH_BITS // 8, "big") for h in hashes)
+        bits = numpy.unpackbits(numpy.frombuffer(packed, dtype=numpy.uint8).reshape(len(hashes), HASH_BITS // 8), axis=1)
+        bits = bits.astype(numpy.float32)
+        ones = bits.sum(axis=1)
+        for start in range(0, len(hashes), COMPARE_BLOCK):
+            # Hamming distance as a matrix product: |a| + |b| - 2 a.b
+            block = bits[start:start + COMPARE_BLOCK]
+            distances = ones[start:start + COMPARE_BLOCK, None] + ones[None, :] - 2 * (block @ bits.T)
+            rows, cols = numpy.nonzero(distances <= threshold)
+            rows += start
+            keep = (rows < cols) & (numpy.abs(color_array[rows] - color_array[cols]).max(axis=1) <= COLOR_TOLERANCE)
+            for i, j in zip(rows[keep], cols[keep]):
+                yield int(i), int(j)
+        return
+
+    # Without NumPy only drawables in neighbouring color cells are compared.
+    cell = COLOR_TOLERANCE + 1
+    grid = {}
+    for i, color in enumerate(colors):
+        grid.setdefault(tuple(v // cell for v in color), []).append(i)
+    offsets = list(itertools.product((-1, 0, 1), repeat=3))
+    for i, color in enumerate(colors):
+        key = tuple(v // cell for v in color)
+        for offset in offsets:
+            for j in grid.get(tuple(k + o for k, o in zip(key, offset)), ()):
+                if j <= i or bin(hashes[i] ^ hashes[j]).count("1") > threshold: continue
+                if max(abs(x - y) for x, y in zip(color, colors[j])) <= COLOR_TOLERANCE: yield i, j
+
+def hash_sources(sources, workers=None, progress=None):
+    if progress is None: progress = ProgressTracker()
+    if workers is None: workers = default_workers()
+    chunks = [sources[i:i + HASH_CHUNK] for i in range(0, len(sources), HASH_CHUNK)]
+    workers = max(1, min(workers, len(chunks)))
+    results = []
+    progress.report("dedup", 0, len(sources))
+
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+                for chunk_results in pool.map(thumbnail_chunk, chunks):
+                    results.extend(chunk_results)
+                    progress.report("dedup", len(results), len(sources))
+                    if progress.cancelled:
+                        pool.shutdown(wait=True, cancel_futures=True)
+                        break
+            progress.check()
+            return results
+        except (OSError, NotImplementedError, BrokenProcessPool) as e:
+            print(f"Process pool unavailable ({e}), hashing serially.")
+            results = []
+
+    for chunk in chunks:
+        progress.check()
+        results.extend(thumbnail_chunk(chunk))
+        progress.report("dedup", len(results), len(sources))
+    return results
+
+def find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+def union(parents, a, b):
+    a, b = find(parents, a), find(parents, b)
+    if a != b: parents[max(a, b)] = min(a, b)
+
+def dedupe_jobs(jobs, threshold=DEFAULT_THRESHOLD, workers=None, progress=None):
+    # Takes single-name jobs for leftover drawables and returns (jobs, report):
+    # one job per group, named after its largest member, with the other names
+    # linked to it. bytes_saved counts the source bytes that are no longer encoded.
+    infos = hash_sources([job[0] for job in jobs], workers, progress)
+    parents = list(range(len(jobs)))
+
+    by_digest = {}
+    for i, (digest, size, area, thumb, color) in enumerate(infos):
+        if digest in by_digest:
+            union(parents, by_digest[digest], i)
+        else:
+            by_digest[digest] = i
+
+    # Exact copies share a hash already, so only one of each is compared.
+    hashed = [i for i in by_digest.values() if infos[i][3] is not None]
+    hashes = difference_hashes([infos[i][3] for i in hashed]) if hashed else []
+    for a, b in near_pairs(hashes, [infos[i][4] for i in hashed], threshold):
+        union(parents, hashed[a], hashed[b])
+
+    groups = {}
+    for i in range(len(jobs)):
+        groups.setdefault(find(parents, i), []).append(i)
+
+    deduped = []
+    report = {"threshold": threshold, "drawables": len(jobs), "groups": 0, "exact_duplicates": 0,
+              "near_duplicates": 0, "bytes_saved": 0, "numpy": numpy is not None}
+    for members in groups.values():
+        canonical = max(members, key=lambda i: (infos[i][2], -i))
+        names = [jobs[canonical][2][0]] + [jobs[i][2][0] for i in members if i != canonical]
+        source_path, dest_folder, _, normalize, cache_path = jobs[canonical]
+        deduped.append(make_job(source_path, dest_folder, names, normalize, cache_path))
+        if len(members) == 1: continue
+        report["groups"] += 1
+        for i in members:
+            if i == canonical: continue
+            if infos[i][0] == infos[canonical][0]: report["exact_duplicates"] += 1
+            else: report["near_duplicates"] += 1
+            report["bytes_saved"] += infos[i][1]
+    return deduped, report
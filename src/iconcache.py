@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+import argparse
+import configparser
+import os
+import struct
+import sys
+import tempfile
+
+# Writes GTK's icon-theme.cache (format 1.0, the one gtk-update-icon-cache
+# produces) so GTK and KDE can look icons up without scanning the theme
+# directories. All numbers are big-endian and every offset is 4-byte aligned:
+#
+#   header:     u16 major, u16 minor, u32 hash offset, u32 directory list offset
+#   hash:       u32 bucket count, u32 first icon offset per bucket
+#   icon:       u32 next icon in bucket, u32 name offset, u32 image list offset
+#   image list: u32 count, then per image u16 directory index, u16 flags, u32 image data (0)
+#   dir list:   u32 count, u32 name offset per directory
+
+CACHE_NAME = "icon-theme.cache"
+MAJOR_VERSION = 1
+MINOR_VERSION = 0
+NO_OFFSET = 0xFFFFFFFF
+
+SUFFIX_FLAGS = {".xpm": 1, ".svg": 2, ".png": 4}
+
+def icon_name_hash(name):
+    # GTK hashes the name as signed chars.
+    data = name.encode("utf-8")
+    if not data: return 0
+    h = data[0] - 256 if data[0] > 127 else data[0]
+    for b in data[1:]:
+        h = ((h << 5) - h + (b - 256 if b > 127 else b)) & 0xFFFFFFFF
+    return h & 0xFFFFFFFF
+
+def bucket_count(n_icons):
+    n = max(n_icons // 3, 1) | 1
+    while any(n % d == 0 for d in range(3, int(n ** 0.5) + 1, 2)): n += 2
+    return n
+
+def theme_directories(theme_root):
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    parser.read(os.path.join(theme_root, "index.theme"), encoding="utf-8")
+    if not parser.has_section("Icon Theme"): return []
+    directories = []
+    for key in ("Directories", "ScaledDirectories"):
+        for d in parser.get("Icon Theme", key, fallback="").split(","):
+            d = d.strip()
+            if d and d not in directories: directories.append(d)
+    return directories
+
+def scan_directory(path):
+    entries = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            name, ext = os.path.splitext(entry.name)
+            flag = SUFFIX_FLAGS.get(ext)
+            if not flag or not entry.is_file(): continue
+            entries[name] = entries.get(name, 0) | flag
+    return entries
+
+def pad_string(text):
+    data = text.encode("utf-8") + b"\0"
+    return data + b"\0" * (-len(data) % 4)
+
+def build_icon_cache(directories, icons):
+    # icons maps an icon name to [(directory index, flags)].
+    buf = bytearray(12)
+
+    hash_offset = len(buf)
+    n_buckets = bucket_count(len(icons))
+    buf += bytes(4 * (n_buckets + 1))
+    buckets = [[] for _ in range(n_buckets)]
+    for name in icons:
+        buckets[icon_name_hash(name) % n_buckets].append(name)
+
+    heads = []
+    for chain in buckets:
+        head = NO_OFFSET
+        previous = None
+        for name in chain:
+            icon_offset = len(buf)
+            buf += bytes(12)
+            name_offset = len(buf)
+            buf += pad_string(name)
+            list_offset = len(buf)
+            images = icons[name]
+            buf += struct.pack(">I", len(images))
+            for dir_index, flags in images:
+                buf += struct.pack(">HHI", dir_index, flags, 0)
+            struct.pack_into(">III", buf, icon_offset, NO_OFFSET, name_offset, list_offset)
+            if previous is None: head = icon_offset
+            else: struct.pack_into(">I", buf, previous, icon_offset)
+            previous = icon_offset
+        heads.append(head)
+    struct.pack_into(f">I{n_buckets}I", buf, hash_offset, n_buckets, *heads)
+
+    dir_list_offset = len(buf)
+    buf += bytes(4 * (len(directories) + 1))
+    name_offsets = []
+    for d in directories:
+        name_offsets.append(len(buf))
+        buf += pad_string(d)
+    struct.pack_into(f">I{len(directories)}I", buf, dir_list_offset, len(directories), *name_offsets)
+
+    struct.pack_into(">HHII", buf, 0, MAJOR_VERSION, MINOR_VERSION, hash_offset, dir_list_offset)
+    return bytes(buf)
+
+def parse_icon_cache(data):
+    # Returns (directories, icons) and raises ValueError on anything GTK would choke on.
+    def read_string(offset):
+        end = data.find(b"\0", offset)
+        if offset >= len(data) or end < 0: raise ValueError(f"string at {offset} runs past the end")
+        return data[offset:end].decode("utf-8")
+
+    try:
+        major, minor, hash_offset, dir_list_offset = struct.unpack_from(">HHII", data, 0)
+        if (major, minor) != (MAJOR_VERSION, MINOR_VERSION):
+            raise ValueError(f"unsupported cache version {major}.{minor}")
+        if hash_offset % 4 or dir_list_offset % 4: raise ValueError("unaligned header offsets")
+
+        n_dirs, = struct.unpack_from(">I", data, dir_list_offset)
+        directories = [read_string(struct.unpack_from(">I", data, dir_list_offset + 4 + 4 * i)[0]) for i in range(n_dirs)]
+
+        n_buckets, = struct.unpack_from(">I", data, hash_offset)
+        if n_buckets == 0: raise ValueError("hash table has no buckets")
+        icons = {}
+        max_steps = len(data) // 12
+        for bucket in range(n_buckets):
+            offset, = struct.unpack_from(">I", data, hash_offset + 4 + 4 * bucket)
+            steps = 0
+            while offset != NO_OFFSET:
+                steps += 1
+                if steps > max_steps: raise ValueError(f"loop in hash chain {bucket}")
+                if offset % 4: raise ValueError(f"unaligned icon at {offset}")
+                chain_offset, name_offset, list_offset = struct.unpack_from(">III", data, offset)
+                name = read_string(name_offset)
+                if icon_name_hash(name) % n_buckets != bucket:
+                    raise ValueError(f"icon '{name}' is in the wrong hash bucket")
+                n_images, = struct.unpack_from(">I", data, list_offset)
+                images = []
+                for i in range(n_images):
+                    dir_index, flags, _ = struct.unpack_from(">HHI", data, list_offset + 4 + 8 * i)
+                    if dir_index >= n_dirs: raise ValueError(f"icon '{name}' points at directory {dir_index}")
+                    images.append((dir_index, flags))
+                icons[name] = images
+                offset = chain_offset
+    except struct.error as e:
+        raise ValueError(f"truncated cache: {e}")
+    return directories, icons
+
+def read_icon_cache(path):
+    with open(path, "rb") as f:
+        return parse_icon_cache(f.read())
+
+def write_icon_cache(theme_root, directories=None):
+    # Directories untouched since the previous cache was written keep their
+    # entries from it; only changed ones are listed again.
+    if directories is None: directories = theme_directories(theme_root)
+    path = os.path.join(theme_root, CACHE_NAME)
+
+    previous = {}
+    try:
+        cache_mtime = os.stat(path).st_mtime_ns
+        old_dirs, old_icons = read_icon_cache(path)
+        previous = {d: {} for d in old_dirs}
+        for name, images in old_icons.items():
+            for dir_index, flags in images:
+                previous[old_dirs[dir_index]][name] = flags
+    except (OSError, ValueError):
+        cache_mtime = None
+
+    present = []
+    icons = {}
+    for d in directories:
+        full = os.path.join(theme_root, d)
+        try: dir_mtime = os.stat(full).st_mtime_ns
+        except OSError: continue
+        if d in previous and dir_mtime < cache_mtime: entries = previous[d]
+        else: entries = scan_directory(full)
+        dir_index = len(present)
+        present.append(d)
+        for name in sorted(entries):
+            icons.setdefault(name, []).append((dir_index, entries[name]))
+
+    data = build_icon_cache(present, icons)
+    fd, tmp_path = tempfile.mkstemp(dir=theme_root, prefix=".icon-theme.cache.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path): os.unlink(tmp_path)
+        raise
+
+    # GTK ignores a cache older than the theme folder, and writing it just
+    # bumped the folder's mtime. Same trick as gtk-update-icon-cache.
+    root_stat = os.stat(theme_root)
+    os.utime(theme_root, ns=(root_stat.st_atime_ns, os.stat(path).st_mtime_ns))
+    return path
+
+def validate_icon_cache(theme_root):
+    # Returns a list of problems, empty when the cache matches the theme.
+    path = os.path.join(theme_root, CACHE_NAME)
+    if not os.path.exists(path): return [f"{path} does not exist"]
+    try:
+        directories, icons = read_icon_cache(path)
+    except ValueError as e:
+        return [f"{path} is invalid: {e}"]
+
+    problems = []
+    if os.stat(path).st_mtime < os.stat(theme_root).st_mtime:
+        problems.append("cache is older than the theme folder, GTK will ignore it")
+
+    cached = {d: {} for d in directories}
+    for name, images in icons.items():
+        for dir_index, flags in images:
+            cached[directories[dir_index]][name] = flags
+
+    for d in theme_directories(theme_root):
+        full = os.path.join(theme_root, d)
+        if not os.path.isdir(full): continue
+        if d not in cached:
+            problems.append(f"{d}: missing from the cache")
+            continue
+        actual = scan_directory(full)
+        missing = sorted(set(actual) - set(cached[d]))
+        stale = sorted(set(cached[d]) - set(actual))
+        wrong = sorted(n for n in actual if n in cached[d] and actual[n] != cached[d][n])
+        if missing: problems.append(f"{d}: {len(missing)} icons not in the cache (e.g. {missing[0]})")
+        if stale: problems.append(f"{d}: {len(stale)} cached icons no longer exist (e.g. {stale[0]})")
+        if wrong: problems.append(f"{d}: {len(wrong)} icons with wrong file types (e.g. {wrong[0]})")
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write or check the icon-theme.cache of an icon theme.")
+    parser.add_argument("theme", help="theme folder containing index.theme")
+    parser.add_argument("--check", action="store_true", help="only validate the existing cache")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        problems = validate_icon_cache(args.theme)
+        for problem in problems: print(problem)
+        if not problems: print("Cache is up to date.")
+        return 1 if problems else 0
+
+    print(write_icon_cache(args.theme))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,6 +17,29 @@ class IsomorphiconApplication(Adw.Application):
     def __init__(self):
         super().__init__(application_id='io.github.vdoesui.Isomorphicon',
                          flags=Gio.ApplicationFlags.FLAGS_NONE)
+        # Started by D-Bus activation (--gapplication-service) it stays up
+        # this long after the last conversion job.
+        self.set_inactivity_timeout(10 * 60 * 1000)
+        self.service_registration = None
+
+    def do_dbus_register(self, connection, object_path):
+        # Conversion jobs can be submitted to the running app over D-Bus.
+        try:
+            from gi.repository import GLib
+            from service import ConversionService, export_service
+            # Created on the first D-Bus call, a plain launch never loads the mappings for it.
+            service = lambda: ConversionService(os.path.join('/app/share/isomorphicon', 'Config'))
+            self.service_registration = export_service(connection, object_path, service,
+                                                       lambda job_id: self.hold(),
+                                                       lambda job: GLib.idle_add(self.release))
+            print(f"🛰️ [PYTHON] Servicio de conversión en {object_path}", flush=True)
+        except Exception as e:
+            print(f"❌ [PYTHON] Error registrando el servicio: {e}", flush=True)
+        return Adw.Application.do_dbus_register(self, connection, object_path)
+
+    def do_dbus_unregister(self, connection, object_path):
+        if self.service_registration: connection.unregister_object(self.service_registration)
+        Adw.Application.do_dbus_unregister(self, connection, object_path)
 
     def do_activate(self):
         print("🖥️ [PYTHON] Activando ventana...", flush=True)
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import pickle
+from matchindex import prepare_wanted
+from cache import default_cache_dir
+
+COMPILED_NAME = "mappings.compiled"
+COMPILED_VERSION = 1
+
+_loaded = {}
+
+def default_config_dir():
+    # Config is installed next to the modules in pkgdatadir, and sits next to
+    # them in a source checkout too; the scripts themselves live in bindir.
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), "Config")
+
+def load_config(config_dir):
+    mappings_path = os.path.join(config_dir, "mappings.json")
+    synonyms_path = os.path.join(config_dir, "synonyms.json")
+
+    if not os.path.exists(mappings_path):
+        raise FileNotFoundError(f"Missing mappings.json at {mappings_path}")
+
+    with open(mappings_path, 'r') as f:
+        mappings = json.load(f)
+
+    synonyms = {}
+    if os.path.exists(synonyms_path):
+        with open(synonyms_path, 'r') as f:
+            synonyms = json.load(f)
+    return mappings, synonyms
+
+def generate_criteria(key_source, target_list, synonyms):
+    criteria = []
+
+    if "." in key_source:
+        criteria.append(key_source.replace(".", "_"))
+        parts = key_source.split('.')
+        if len(parts) > 1:
+            last = parts[-1]
+            if last not in ["android", "app", "mobile"]:
+                criteria.append(last)
+    else:
+        criteria.append(key_source)
+
+    if synonyms and key_source in synonyms:
+        criteria.extend(synonyms[key_source])
+
+    if key_source.startswith("resource_"):
+        criteria.append(key_source.replace("resource_", ""))
+
+    for t in target_list:
+        clean_t = t.replace("org.", "").replace("com.", "").replace("kde.", "").replace("-", "_")
+        if "." in clean_t: clean_t = clean_t.split(".")[-1]
+        criteria.append(clean_t)
+
+    return criteria
+
+def compile_entries(mappings, synonyms):
+    entries = {}
+    for key_source, targets in mappings.items():
+        if key_source == "__COMMENT__": continue
+        target_list = targets if isinstance(targets, list) else [targets]
+        criteria = generate_criteria(key_source, target_list, synonyms)
+        entries[key_source] = {
+            "targets": target_list,
+            "category": "places" if key_source.startswith("resource_folder") else "apps",
+            "criteria": criteria,
+            "prepared": prepare_wanted(criteria)
+        }
+    return entries
+
+class MappingDB:
+    # mappings.json and synonyms.json with the match criteria of every key
+    # precomputed. digest identifies the JSON sources it was built from.
+
+    def __init__(self, mappings, synonyms, digest=None):
+        self.mappings = mappings
+        self.synonyms = synonyms
+        self.digest = digest
+        self.entries = compile_entries(mappings, synonyms)
+
+def source_digest(config_dir):
+    h = hashlib.sha256()
+    for name in ["mappings.json", "synonyms.json"]:
+        path = os.path.join(config_dir, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                h.update(f.read())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def compiled_paths(config_dir):
+    # The installed Config/ folder is read-only inside Flatpak, so fall back
+    # to the user cache.
+    key = hashlib.sha256(os.path.abspath(config_dir).encode("utf-8")).hexdigest()[:16]
+    return [
+        os.path.join(config_dir, COMPILED_NAME),
+        os.path.join(default_cache_dir(), f"mappings-{key}.compiled")
+    ]
+
+def read_compiled(path, digest):
+    try:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+    except Exception:
+        return None
+    if data.get("version") != COMPILED_VERSION or data.get("digest") != digest: return None
+    return data["db"]
+
+def write_compiled(db, config_dir):
+    for path in compiled_paths(config_dir):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"version": COMPILED_VERSION, "digest": db.digest, "db": db}, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            return path
+        except OSError:
+            continue
+    return None
+
+def load_mapping_db(config_dir):
+    digest = source_digest(config_dir)
+    db = _loaded.get(config_dir)
+    if db and db.digest == digest: return db
+
+    db = None
+    for path in compiled_paths(config_dir):
+        db = read_compiled(path, digest)
+        if db: break
+
+    if db is None:
+        mappings, synonyms = load_config(config_dir)
+        db = MappingDB(mappings, synonyms, digest)
+        write_compiled(db, config_dir)
+
+    _loaded[config_dir] = db
+    return db
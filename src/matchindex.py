@@ -0,0 +1,146 @@
+import os
+
+STRIP_PREFIXES = ["ic_", "icon_", "app_", "launcher_"]
+
+def strip_name(filename):
+    clean_fname = filename.lower()
+    for p in STRIP_PREFIXES:
+        clean_fname = clean_fname.replace(p, "")
+    return clean_fname
+
+def tokenize(clean_fname):
+    return clean_fname.replace("-", "_").split("_")
+
+def prepare_wanted(wanted_list):
+    prepared = []
+    for wanted in wanted_list:
+        wanted = wanted.lower()
+        parts = wanted.replace("-", "_").split("_")
+        acronym = "".join([p[0] for p in parts]) if len(parts) > 1 else ""
+        prepared.append((wanted, acronym))
+    return prepared
+
+def score_prepared(clean_fname, tokens, prepared):
+    max_s = 0
+
+    for wanted, acronym in prepared:
+        score = 0
+
+        if clean_fname == wanted:
+            score = 1000
+
+        elif wanted in tokens:
+            penalty = (len(tokens) - 1) * 20
+            score = 800 - penalty
+
+        elif acronym and clean_fname == acronym:
+            score = 600
+
+        elif clean_fname.startswith(wanted):
+            score = 500
+
+        elif wanted in clean_fname:
+            ratio = len(wanted) / len(clean_fname)
+            score = int(100 * ratio) - 10
+
+        if score > max_s: max_s = score
+    return max_s
+
+class MatchIndex:
+    # Substring hits only reach the 50 point threshold when the wanted name
+    # covers at least 60% of the stripped filename, so longer names can be
+    # skipped without changing any winner.
+    MIN_SUBSTRING_COVERAGE = 0.59
+
+    def __init__(self, available_files):
+        self.names = []
+        self.paths = []
+        self.stripped = []
+        self.tokens = []
+        self.by_stripped = {}
+        self.by_token = {}
+        self.acronyms = {}
+        self.trie = {}
+        self.grams = {}
+        self.short_names = {}
+
+        for name, path in available_files.items():
+            self.add(name, path)
+
+    def add(self, name, path):
+        idx = len(self.names)
+        clean = strip_name(name)
+        tokens = tokenize(clean)
+
+        self.names.append(name)
+        self.paths.append(path)
+        self.stripped.append(clean)
+        self.tokens.append(tokens)
+
+        self.by_stripped.setdefault(clean, []).append(idx)
+        if "_" not in clean and "-" not in clean:
+            self.acronyms.setdefault(clean, []).append(idx)
+        for tok in set(tokens):
+            self.by_token.setdefault(tok, []).append(idx)
+
+        node = self.trie
+        for ch in clean:
+            node = node.setdefault(ch, {})
+            node.setdefault(None, []).append(idx)
+
+        if len(clean) <= 3:
+            self.short_names.setdefault(len(clean), []).append(idx)
+        for i in range(len(clean) - 2):
+            self.grams.setdefault(clean[i:i + 3], set()).add(idx)
+
+    def with_prefix(self, prefix):
+        if not prefix: return range(len(self.names))
+        node = self.trie
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None: return []
+        return node.get(None, [])
+
+    def containing(self, wanted):
+        max_len = len(wanted) / self.MIN_SUBSTRING_COVERAGE
+        if len(wanted) < 3:
+            found = []
+            for length, ids in self.short_names.items():
+                if length <= max_len: found.extend(ids)
+        else:
+            found = None
+            for i in range(len(wanted) - 2):
+                ids = self.grams.get(wanted[i:i + 3])
+                if not ids: return []
+                found = set(ids) if found is None else found & ids
+                if not found: return []
+        return [i for i in found if len(self.stripped[i]) <= max_len and wanted in self.stripped[i]]
+
+    def candidates(self, prepared):
+        found = set()
+        for wanted, acronym in prepared:
+            found.update(self.by_stripped.get(wanted, ()))
+            found.update(self.by_token.get(wanted, ()))
+            if acronym: found.update(self.acronyms.get(acronym, ()))
+            found.update(self.with_prefix(wanted))
+            found.update(self.containing(wanted))
+        return sorted(found)
+
+    def best_match(self, wanted_list):
+        return self.best_match_prepared(prepare_wanted(wanted_list))
+
+    def best_match_prepared(self, prepared):
+        best_score = 0
+        best_file_path = None
+
+        for idx in self.candidates(prepared):
+            score = score_prepared(self.stripped[idx], self.tokens[idx], prepared)
+
+            if score > best_score:
+                best_score = score
+                best_file_path = self.paths[idx]
+            elif score == best_score and score > 0:
+                if len(self.names[idx]) < len(os.path.basename(best_file_path)):
+                    best_file_path = self.paths[idx]
+
+        return best_file_path, best_score
@@ -0,0 +1,65 @@
+import json
+import os
+from converter import PLAN_VERSION
+from metrics import MATCH_COUNTERS
+
+# Match plans are what converter.dry_run_apk returns, stored as JSON next to
+# the themes. They hold every matching decision, so a plan can be compared
+# with an earlier one while tuning the mappings, or handed back to
+# convert_apk to write the theme without matching again.
+
+PLAN_SUFFIX = ".plan.json"
+
+def plan_path(output_folder, theme_name):
+    return os.path.join(output_folder, f"{theme_name}{PLAN_SUFFIX}")
+
+def save_plan(plan, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(plan, f, indent=1)
+        f.write("\n")
+    os.replace(tmp_path, path)
+    return path
+
+def load_plan(path):
+    with open(path, "r") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"{path} is a version {plan.get('version')} plan, expected version {PLAN_VERSION}.")
+    return plan
+
+def matched(record):
+    return record is not None and record["phase"] != "FAILED"
+
+def diff_plans(old, new):
+    # Coverage changes between two plans of the same pack, keyed by package.
+    before = {m["package"]: m for m in old["matches"]}
+    after = {m["package"]: m for m in new["matches"]}
+    diff = {
+        "stats": {k: [old["stats"].get(k, 0), new["stats"].get(k, 0)] for k in MATCH_COUNTERS},
+        "gained": [],
+        "lost": [],
+        "changed": []
+    }
+    for pkg in list(before) + [p for p in after if p not in before]:
+        a, b = before.get(pkg), after.get(pkg)
+        if matched(b) and not matched(a): diff["gained"].append(b)
+        elif matched(a) and not matched(b): diff["lost"].append(a)
+        elif matched(a) and (a["drawable"], a["phase"], a["targets"]) != (b["drawable"], b["phase"], b["targets"]):
+            diff["changed"].append({"package": pkg, "before": a, "after": b})
+    return diff
+
+def describe(record):
+    return f"{record['drawable']} via {record['phase']} (score {record['score']})"
+
+def format_diff(diff):
+    lines = []
+    changes = [f"{k} {a}->{b}" for k, (a, b) in diff["stats"].items() if a != b]
+    lines.append("  coverage: " + (", ".join(changes) if changes else "unchanged"))
+    for record in diff["gained"]:
+        lines.append(f"  + {record['package']}: {describe(record)}")
+    for record in diff["lost"]:
+        lines.append(f"  - {record['package']}: was {describe(record)}")
+    for change in diff["changed"]:
+        lines.append(f"  ~ {change['package']}: {describe(change['before'])} -> {describe(change['after'])}")
+    return lines
@@ -0,0 +1,208 @@
+import glob
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+MATCH_COUNTERS = ["XML_MATCH", "DIRECT_EXACT_MATCH", "DIRECT_PREFIX_MATCH", "SCORED_MATCH", "FAILED"]
+PROFILERS = ["cprofile", "tracemalloc"]
+
+class ConversionMetrics:
+    # Collected per convert_apk call, so concurrent conversions in one process
+    # no longer share counters. Phases may be entered many times (the match
+    # phases run once per mapping); their times accumulate. A phase's cpu is
+    # that of the thread it ran on, the pipeline runs matching on its own.
+
+    def __init__(self, profile_phase=None, profiler="cprofile"):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profiler}', expected one of {PROFILERS}")
+        self.phases = {}
+        self.counts = {k: 0 for k in MATCH_COUNTERS}
+        self.images_decoded = 0
+        self.images_passed_through = 0
+        self.images_scaled = 0
+        self.encode_policy = None
+        self.memory_budget = None
+        # Icon names installed apps use, when the theme is limited to them.
+        self.wanted_names = None
+        self.peak_rss_kb = None
+        self.encode_rss_kb = None
+        # Largest ru_maxrss an encoding process reported with its jobs.
+        self.worker_rss_kb = None
+        self.bytes_written = 0
+        self.encode_time = 0.0
+        # encode_time split into mapped icons and leftover drawables.
+        self.encode_time_by_kind = {}
+        self.write_failures = 0
+        self.dedup = None
+        self.sync = None
+        # Calendar prefixes, iconback/iconmask/iconupon images and scale of
+        # the pack's appfilter.xml (see converter.parse_appfilter).
+        self.appfilter = None
+        # Match records of the conversion (see converter.match_record); too
+        # bulky for to_dict, the window's results view reads them directly.
+        self.matches = None
+        self.profile_phase = profile_phase
+        self.profiler = profiler
+        self.profile = None
+        self._profile_state = None
+
+    def count(self, counter, amount=1):
+        self.counts[counter] += amount
+
+    def add_encode_stats(self, stats):
+        self.images_decoded += stats["decoded"]
+        self.images_passed_through += stats["passthrough"]
+        self.images_scaled += stats["scaled"]
+        self.bytes_written += stats["bytes"]
+        self.encode_time += stats["encode_time"]
+        if stats.get("rss_kb"): self.worker_rss_kb = max(self.worker_rss_kb or 0, stats["rss_kb"])
+        kind = stats.get("kind")
+        if kind: self.encode_time_by_kind[kind] = self.encode_time_by_kind.get(kind, 0.0) + stats["encode_time"]
+
+    @contextmanager
+    def phase(self, name):
+        profiling = name == self.profile_phase
+        if profiling: self._start_profile()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - wall, time.thread_time() - cpu)
+            if profiling: self._stop_profile()
+
+    def add_phase(self, name, wall, cpu):
+        # For phases timed by hand, e.g. on another thread.
+        entry = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        entry["wall"] += wall
+        entry["cpu"] += cpu
+        entry["calls"] += 1
+
+    def _start_profile(self):
+        if self.profiler == "cprofile":
+            import cProfile
+            if self._profile_state is None: self._profile_state = cProfile.Profile()
+            self._profile_state.enable()
+        else:
+            import tracemalloc
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+
+    def _stop_profile(self):
+        if self.profiler == "cprofile":
+            self._profile_state.disable()
+        else:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            if self.profile is None or peak >= self.profile["peak_bytes"]:
+                self.profile = snapshot_to_dict(snapshot, peak)
+
+    def to_dict(self):
+        if self.profiler == "cprofile" and self._profile_state is not None:
+            self.profile = profile_to_dict(self._profile_state)
+        return {
+            "phases": {k: {"wall": round(v["wall"], 6), "cpu": round(v["cpu"], 6), "calls": v["calls"]} for k, v in self.phases.items()},
+            "counts": dict(self.counts),
+            "images_decoded": self.images_decoded,
+            "images_passed_through": self.images_passed_through,
+            "images_scaled": self.images_scaled,
+            "encode_policy": self.encode_policy,
+            "bytes_written": self.bytes_written,
+            "encode_time": round(self.encode_time, 6),
+            "encode_time_by_kind": {k: round(v, 6) for k, v in self.encode_time_by_kind.items()},
+            "write_failures": self.write_failures,
+            "memory_budget": self.memory_budget,
+            "wanted_names": self.wanted_names,
+            "peak_rss_kb": self.peak_rss_kb,
+            "encode_rss_kb": self.encode_rss_kb,
+            "dedup": self.dedup,
+            "sync": self.sync,
+            "appfilter": self.appfilter,
+            "profile": {"phase": self.profile_phase, "profiler": self.profiler, "data": self.profile} if self.profile_phase else None
+        }
+
+    def to_json(self, path=None):
+        text = json.dumps(self.to_dict(), indent=2)
+        if path:
+            with open(path, "w") as f:
+                f.write(text + "\n")
+        return text
+
+def peak_rss_kb_by_process(workers_kb=None):
+    # Highest resident set of this process and of its largest child so far.
+    # RUSAGE_CHILDREN only knows children that exited and were waited for,
+    # and pool workers are children of the fork server, so their own peak
+    # (ConversionMetrics.worker_rss_kb) is passed in as workers_kb.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self": own, "children": max(children, workers_kb or 0)}
+
+class RssSampler:
+    # Samples the resident set of this process plus all its descendants (the
+    # fork server and the pool workers it forked) while in use. ru_maxrss only knows the largest
+    # single process, but a memory budget bounds their sum. Linux only;
+    # peak_kb stays None without /proc.
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_kb = None
+        self.stop = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            total = resident_kb(os.getpid())
+            if total is None: return
+            total += sum(resident_kb(pid) or 0 for pid in descendants(os.getpid()))
+            self.peak_kb = max(self.peak_kb or 0, total)
+            if self.stop.wait(self.interval): return
+
+def descendants(pid):
+    found = []
+    pending = [str(pid)]
+    while pending:
+        for path in glob.glob(f"/proc/{pending.pop()}/task/*/children"):
+            try:
+                with open(path) as f: pids = f.read().split()
+            except OSError:
+                continue
+            found.extend(pids)
+            pending.extend(pids)
+    return found
+
+def resident_kb(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+def profile_to_dict(profile, limit=30):
+    import pstats
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, func), (cc, nc, tottime, cumtime, callers) in stats.stats.items():
+        rows.append({"function": f"{filename}:{line}({func})", "calls": nc, "tottime": round(tottime, 6), "cumtime": round(cumtime, 6)})
+    rows.sort(key=lambda r: r["cumtime"], reverse=True)
+    return {"total_time": round(stats.total_tt, 6), "functions": rows[:limit]}
+
+def snapshot_to_dict(snapshot, peak, limit=30):
+    rows = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        rows.append({"location": f"{frame.filename}:{frame.lineno}", "size": stat.size, "count": stat.count})
+    return {"peak_bytes": peak, "allocations": rows}
@@ -0,0 +1,221 @@
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from iconcache import theme_directories
+from gi.repository import Gdk, Gio, GLib, GObject, Gtk, Pango
+
+# Results view shown after a conversion: one tile per written target with
+# its thumbnail, the drawable it came from and how it was matched. Gtk.GridView
+# only creates widgets for the visible tiles and recycles them while
+# scrolling, and thumbnails are decoded on a thread pool into a byte-bounded
+# LRU of textures, so a pack with thousands of 512px icons stays responsive
+# and its memory use flat.
+
+THUMB_SIZE = 96
+CACHE_BYTES = 64 * 1024 * 1024
+DECODE_WORKERS = min(4, os.cpu_count() or 1)
+
+PHASE_NAMES = {
+    "XML_MATCH": "appfilter.xml",
+    "DIRECT_EXACT_MATCH": "Exact name",
+    "DIRECT_PREFIX_MATCH": "Name prefix",
+    "SCORED_MATCH": "Fuzzy match"
+}
+
+def decode_thumbnail(path, size):
+    # Returns (width, height, RGBA bytes), or None if the file can't be read.
+    try:
+        with Image.open(path) as img:
+            if img.mode != "RGBA": img = img.convert("RGBA")
+            img.thumbnail((size, size), Image.LANCZOS, reducing_gap=2.0)
+            return img.width, img.height, img.tobytes()
+    except Exception:
+        return None
+
+class ThumbnailCache:
+    # request() returns a cached texture or starts decoding the file and
+    # calls callback(path, texture) on the main loop once done (texture is
+    # None for unreadable files). Only the main thread touches the cache.
+
+    def __init__(self, size=THUMB_SIZE, max_bytes=CACHE_BYTES, workers=DECODE_WORKERS):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.textures = collections.OrderedDict()
+        self.bytes = 0
+        self.pending = {}
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+
+    def request(self, path, callback):
+        entry = self.textures.get(path)
+        if entry:
+            self.textures.move_to_end(path)
+            return entry[0]
+        if path in self.pending:
+            self.pending[path][1].append(callback)
+            return None
+        future = self.pool.submit(decode_thumbnail, path, self.size)
+        self.pending[path] = (future, [callback])
+        future.add_done_callback(lambda f: GLib.idle_add(self.finish, path, f))
+        return None
+
+    def withdraw(self, path, callback):
+        # The tile was recycled before its thumbnail arrived; files nobody
+        # waits for any more are not decoded at all.
+        entry = self.pending.get(path)
+        if not entry: return
+        future, callbacks = entry
+        if callback in callbacks: callbacks.remove(callback)
+        if not callbacks and future.cancel(): del self.pending[path]
+
+    def finish(self, path, future):
+        entry = self.pending.get(path)
+        if entry is None or entry[0] is not future or future.cancelled(): return False
+        del self.pending[path]
+        decoded = future.result()
+        texture = None
+        if decoded:
+            width, height, data = decoded
+            texture = Gdk.MemoryTexture.new(width, height, Gdk.MemoryFormat.R8G8B8A8, GLib.Bytes.new(data), width * 4)
+            self.store(path, texture, len(data))
+        for callback in entry[1]: callback(path, texture)
+        return False
+
+    def store(self, path, texture, size):
+        self.textures[path] = (texture, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and len(self.textures) > 1:
+            _, (_, old_size) = self.textures.popitem(last=False)
+            self.bytes -= old_size
+
+    def clear(self):
+        for future, callbacks in self.pending.values(): future.cancel()
+        self.pending = {}
+        self.textures.clear()
+        self.bytes = 0
+
+class ResultItem(GObject.Object):
+    __gtype_name__ = "IsomorphiconResultItem"
+
+    def __init__(self, target, package, drawable, phase, path):
+        super().__init__()
+        self.target = target
+        self.package = package
+        self.drawable = drawable
+        self.phase = phase
+        self.path = path
+
+def thumbnail_folder(theme_root, category):
+    # The smallest size folder index.theme lists that still gives sharp
+    # thumbnails; the 512x512 one unless smaller sizes were written.
+    sizes = []
+    for directory in theme_directories(theme_root):
+        folder_category, _, name = directory.partition("/")
+        width, _, height = name.partition("x")
+        if folder_category == category and width.isdigit() and width == height: sizes.append(int(width))
+    if not sizes: return os.path.join(theme_root, category, "512x512")
+    size = min([s for s in sizes if s >= THUMB_SIZE] or [max(sizes)])
+    return os.path.join(theme_root, category, f"{size}x{size}")
+
+def result_items(matches, theme_root):
+    items = []
+    folders = {category: thumbnail_folder(theme_root, category) for category in ("apps", "places")}
+    for record in matches or []:
+        if record["phase"] == "FAILED": continue
+        folder = folders["places" if record["category"] == "places" else "apps"]
+        for target in record["targets"]:
+            items.append(ResultItem(target, record["package"], record["drawable"], record["phase"],
+                                    os.path.join(folder, f"{target}.png")))
+    return items
+
+class ResultTile(Gtk.Box):
+    def __init__(self, cache):
+        super().__init__(orientation=Gtk.Orientation.VERTICAL, spacing=4)
+        self.set_margin_top(8)
+        self.set_margin_bottom(8)
+        self.set_margin_start(6)
+        self.set_margin_end(6)
+        self.cache = cache
+        self.item = None
+
+        self.image = Gtk.Image(pixel_size=THUMB_SIZE)
+        self.append(self.image)
+        self.target_label = Gtk.Label(ellipsize=Pango.EllipsizeMode.END, max_width_chars=16)
+        self.target_label.add_css_class("caption-heading")
+        self.append(self.target_label)
+        self.drawable_label = Gtk.Label(ellipsize=Pango.EllipsizeMode.MIDDLE, max_width_chars=16)
+        self.drawable_label.add_css_class("caption")
+        self.append(self.drawable_label)
+        self.phase_label = Gtk.Label()
+        self.phase_label.add_css_class("caption")
+        self.phase_label.add_css_class("dim-label")
+        self.append(self.phase_label)
+
+    def bind(self, item):
+        self.item = item
+        self.target_label.set_label(item.target)
+        self.drawable_label.set_label(item.drawable)
+        self.phase_label.set_label(PHASE_NAMES.get(item.phase, item.phase))
+        self.set_tooltip_text(f"{item.target}\n{item.package} → {item.drawable}")
+        texture = self.cache.request(item.path, self.on_thumbnail)
+        if texture: self.image.set_from_paintable(texture)
+        else: self.image.set_from_icon_name("image-loading-symbolic")
+
+    def unbind(self):
+        if self.item: self.cache.withdraw(self.item.path, self.on_thumbnail)
+        self.item = None
+
+    def on_thumbnail(self, path, texture):
+        if not self.item or self.item.path != path: return
+        if texture: self.image.set_from_paintable(texture)
+        else: self.image.set_from_icon_name("image-missing-symbolic")
+
+class ResultsView(Gtk.Box):
+    def __init__(self):
+        super().__init__(orientation=Gtk.Orientation.VERTICAL)
+        self.cache = ThumbnailCache()
+        self.store = Gio.ListStore.new(ResultItem)
+
+        self.search_entry = Gtk.SearchEntry(placeholder_text="Filter by icon, package or drawable")
+        self.search_entry.set_margin_top(6)
+        self.search_entry.set_margin_bottom(6)
+        self.search_entry.set_margin_start(12)
+        self.search_entry.set_margin_end(12)
+        self.search_entry.connect("search-changed", self.on_search_changed)
+        self.append(self.search_entry)
+
+        self.filter = Gtk.CustomFilter.new(self.matches_search)
+        self.filtered = Gtk.FilterListModel(model=self.store, filter=self.filter)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", lambda f, list_item: list_item.set_child(ResultTile(self.cache)))
+        factory.connect("bind", lambda f, list_item: list_item.get_child().bind(list_item.get_item()))
+        factory.connect("unbind", lambda f, list_item: list_item.get_child().unbind())
+
+        self.grid = Gtk.GridView(model=Gtk.NoSelection(model=self.filtered), factory=factory)
+        self.grid.set_max_columns(12)
+        scrolled = Gtk.ScrolledWindow(vexpand=True)
+        scrolled.set_child(self.grid)
+        self.append(scrolled)
+
+        self.summary_label = Gtk.Label()
+        self.summary_label.add_css_class("dim-label")
+        self.summary_label.set_margin_top(6)
+        self.summary_label.set_margin_bottom(6)
+        self.append(self.summary_label)
+
+    def show_results(self, matches, theme_root):
+        # Files may have been rewritten under the same names, drop old thumbnails.
+        self.cache.clear()
+        items = result_items(matches, theme_root)
+        self.store.splice(0, self.store.get_n_items(), items)
+        self.search_entry.set_text("")
+        self.summary_label.set_label(f"{len(items)} icons in {theme_root}")
+
+    def matches_search(self, item):
+        text = self.search_entry.get_text().strip().lower()
+        if not text: return True
+        return text in item.target.lower() or text in item.package.lower() or text in item.drawable.lower()
+
+    def on_search_changed(self, entry):
+        self.filter.changed(Gtk.FilterChange.DIFFERENT)
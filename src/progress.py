@@ -0,0 +1,35 @@
+import threading
+
+PHASE_LABELS = {
+    "extract": "Decoding APK",
+    "index": "Indexing drawables",
+    "match": "Matching icons",
+    "dedup": "Finding duplicate icons",
+    "encode": "Writing icons",
+    "install": "Installing theme"
+}
+
+class ConversionCancelled(Exception):
+    pass
+
+class ProgressTracker:
+    # Passed down through a conversion: report() forwards (phase, done, total)
+    # to the callback and check() raises ConversionCancelled once cancel()
+    # has been called. The callback runs on the converting thread.
+
+    def __init__(self, callback=None, cancel_event=None):
+        self.callback = callback
+        self.cancel_event = cancel_event or threading.Event()
+
+    def report(self, phase, done, total):
+        if self.callback: self.callback(phase, done, total)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        if self.cancel_event.is_set(): raise ConversionCancelled()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+import collections
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+# Resident conversion service. Mappings, the conversion cache, Pillow and the
+# process pools' imports stay loaded between jobs, so scripts converting many
+# packs in a row only pay for startup once. Jobs are submitted over D-Bus,
+# wait in a bounded queue and run one at a time on a worker thread; every
+# conversion already spreads its encoding over all CPUs.
+#
+# ConversionService holds the queue and never touches gi; export_service()
+# puts it on a bus. The GUI exports it on its own object path, and
+# `isomorphicon-service` runs it headless for machines without a display.
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "share", "isomorphicon"))
+sys.path.append('/app/share/isomorphicon')
+
+import converter
+from cache import ConversionCache
+from mappingdb import load_mapping_db, default_config_dir
+from metrics import ConversionMetrics
+from progress import ProgressTracker
+from targeting import installed_icon_names
+from transcode import ENCODE_POLICIES
+
+BUS_NAME = "io.github.vdoesui.Isomorphicon.Service"
+OBJECT_PATH = "/io/github/vdoesui/Isomorphicon/Service"
+INTERFACE_NAME = "io.github.vdoesui.Isomorphicon.Converter"
+ERROR_PREFIX = "io.github.vdoesui.Isomorphicon.Error"
+
+QUEUE_SIZE = 16
+KEEP_FINISHED = 100
+PROGRESS_INTERVAL = 0.25
+INACTIVITY_TIMEOUT = 10 * 60 * 1000
+
+INTERFACE_XML = f"""
+<node>
+  <interface name="{INTERFACE_NAME}">
+    <method name="Submit">
+      <arg type="s" name="apk" direction="in"/>
+      <arg type="a{{sv}}" name="options" direction="in"/>
+      <arg type="s" name="job" direction="out"/>
+    </method>
+    <method name="GetStatus">
+      <arg type="s" name="job" direction="in"/>
+      <arg type="a{{sv}}" name="status" direction="out"/>
+    </method>
+    <method name="Cancel">
+      <arg type="s" name="job" direction="in"/>
+      <arg type="b" name="cancelled" direction="out"/>
+    </method>
+    <method name="ListJobs">
+      <arg type="as" name="jobs" direction="out"/>
+    </method>
+    <signal name="Progress">
+      <arg type="s" name="job"/>
+      <arg type="s" name="phase"/>
+      <arg type="u" name="done"/>
+      <arg type="u" name="total"/>
+    </signal>
+    <signal name="Finished">
+      <arg type="s" name="job"/>
+      <arg type="s" name="state"/>
+      <arg type="s" name="output"/>
+    </signal>
+    <property name="QueueSize" type="u" access="read"/>
+  </interface>
+</node>
+"""
+
+# Option name -> (D-Bus signature, default). A missing key takes the default.
+JOB_OPTIONS = {
+    "theme": ("s", ""),
+    "output": ("s", os.path.join(os.path.expanduser("~"), "Isomorphicon_Output")),
+    "inherits": ("s", "breeze-dark,breeze,Adwaita,hicolor"),
+    "install": ("b", False),
+    "sync": ("b", False),
+    "workers": ("u", 0),
+    "link_mode": ("s", "symlink"),
+    "encode_policy": ("s", "default"),
+    "dedup_threshold": ("i", -1),
+    "sizes": ("as", []),
+    "installed_apps": ("b", False),
+    "memory_budget": ("u", 0),
+    "backend": ("s", "auto"),
+    "cache": ("b", True)
+}
+
+OPTION_CHOICES = {
+    "link_mode": ["symlink", "hardlink", "copy"],
+    "encode_policy": ENCODE_POLICIES,
+    "backend": ["auto", "zip", "apktool"]
+}
+
+class ServiceError(Exception):
+    # name is appended to ERROR_PREFIX to form the D-Bus error name.
+    def __init__(self, name, message):
+        super().__init__(message)
+        self.name = name
+
+def job_options(apk_path, options):
+    unknown = sorted(set(options) - set(JOB_OPTIONS))
+    if unknown: raise ServiceError("InvalidOption", f"Unknown options: {', '.join(unknown)}")
+    resolved = {k: options.get(k, default) for k, (signature, default) in JOB_OPTIONS.items()}
+    for key, choices in OPTION_CHOICES.items():
+        if resolved[key] not in choices:
+            raise ServiceError("InvalidOption", f"{key} must be one of {choices}, got '{resolved[key]}'")
+    try: resolved["sizes"] = converter.parse_sizes(resolved["sizes"])
+    except ValueError as e: raise ServiceError("InvalidOption", str(e))
+    if not os.path.isfile(apk_path): raise ServiceError("NotFound", f"No such APK: {apk_path}")
+    if not resolved["theme"]: resolved["theme"] = converter.theme_name_from_apk(apk_path) or "theme"
+    return resolved
+
+class ServiceJob:
+    def __init__(self, job_id, apk_path, options):
+        self.id = job_id
+        self.apk_path = apk_path
+        self.options = options
+        self.state = "queued"
+        self.phase = ""
+        self.done = 0
+        self.total = 0
+        self.output = None
+        self.error = None
+        self.metrics = None
+        self.submitted = time.time()
+        self.last_progress = 0.0
+        self.tracker = None
+        self.cancel_event = threading.Event()
+
+    def status(self):
+        status = {
+            "apk": self.apk_path,
+            "theme": self.options["theme"],
+            "state": self.state,
+            "phase": self.phase,
+            "done": self.done,
+            "total": self.total,
+            "output": self.output or "",
+            "error": self.error or "",
+            "submitted": self.submitted
+        }
+        if self.metrics: status["metrics"] = json.dumps(self.metrics)
+        return status
+
+class ConversionService:
+    # on_progress(job, phase, done, total) and on_finished(job) run on the
+    # worker thread.
+
+    def __init__(self, config_dir, queue_size=QUEUE_SIZE, on_progress=None, on_finished=None):
+        self.config_dir = config_dir
+        self.mapping_db = load_mapping_db(config_dir)
+        self.cache = ConversionCache()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.jobs = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.worker = threading.Thread(target=self.run_worker, daemon=True)
+        self.worker.start()
+
+    def submit(self, apk_path, options):
+        apk_path = os.path.abspath(apk_path)
+        resolved = job_options(apk_path, options)
+        with self.lock:
+            job = ServiceJob(str(next(self.ids)), apk_path, resolved)
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                raise ServiceError("QueueFull", f"{self.queue.maxsize} jobs are already waiting")
+            self.jobs[job.id] = job
+            self.forget_finished()
+        return job.id
+
+    def forget_finished(self):
+        finished = [i for i, job in self.jobs.items() if job.state in ("done", "failed", "cancelled")]
+        for job_id in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None: raise ServiceError("NoSuchJob", f"No job {job_id}")
+        return job
+
+    def status(self, job_id):
+        return self.get(job_id).status()
+
+    def list_jobs(self):
+        with self.lock:
+            return list(self.jobs)
+
+    def cancel(self, job_id):
+        # Queued jobs are dropped when the worker reaches them; a running job
+        # stops at its next progress check.
+        job = self.get(job_id)
+        if job.state not in ("queued", "running"): return False
+        job.cancel_event.set()
+        return True
+
+    def run_worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self.run_job(job)
+            except Exception as e:
+                job.state = "failed"
+                job.error = str(e)
+                print(f"Service job {job.id} failed: {e}")
+            if self.on_finished: self.on_finished(job)
+            self.queue.task_done()
+
+    def report(self, job, phase, done, total):
+        job.phase, job.done, job.total = phase, done, total
+        now = time.monotonic()
+        if done < total and done > 0 and now - job.last_progress < PROGRESS_INTERVAL: return
+        job.last_progress = now
+        if self.on_progress: self.on_progress(job, phase, done, total)
+
+    def run_job(self, job):
+        if job.cancel_event.is_set():
+            job.state = "cancelled"
+            return
+        job.state = "running"
+        options = job.options
+        # Picks up edits to mappings.json without restarting the service.
+        self.mapping_db = load_mapping_db(self.config_dir)
+        job.tracker = ProgressTracker(lambda phase, done, total: self.report(job, phase, done, total), job.cancel_event)
+        os.makedirs(options["output"], exist_ok=True)
+        print(f"Service job {job.id}: converting {job.apk_path} into {options['theme']}")
+
+        result, metrics = converter.convert_apk(
+            job.apk_path,
+            self.mapping_db.mappings,
+            self.mapping_db.synonyms,
+            options["output"],
+            options["theme"],
+            options["inherits"],
+            install=options["install"],
+            workers=options["workers"] or None,
+            link_mode=options["link_mode"],
+            encode_policy=options["encode_policy"],
+            dedup_threshold=options["dedup_threshold"] if options["dedup_threshold"] >= 0 else None,
+            sync=options["sync"],
+            sizes=options["sizes"],
+            # Scanned per job, apps may have been installed since the last one.
+            wanted=installed_icon_names() if options["installed_apps"] else None,
+            memory_budget=options["memory_budget"] * 1024 * 1024 or None,
+            backend=options["backend"],
+            cache=self.cache if options["cache"] else None,
+            mapping_db=self.mapping_db,
+            metrics=ConversionMetrics(),
+            progress=job.tracker
+        )
+        job.metrics = metrics.to_dict()
+        job.output = result
+        if result: job.state = "done"
+        elif job.cancel_event.is_set(): job.state = "cancelled"
+        else:
+            job.state = "failed"
+            job.error = "Conversion failed, see the service log for details"
+
+def unpack_options(variant):
+    # a{sv} -> dict, checking each known option against its JOB_OPTIONS type.
+    options = {}
+    for i in range(variant.n_children()):
+        entry = variant.get_child_value(i)
+        key = entry.get_child_value(0).get_string()
+        value = entry.get_child_value(1).get_variant()
+        expected = JOB_OPTIONS.get(key, (None,))[0]
+        if expected and value.get_type_string() != expected:
+            raise ServiceError("InvalidOption", f"{key} must have type '{expected}', got '{value.get_type_string()}'")
+        options[key] = value.unpack()
+    return options
+
+def export_service(connection, object_path, service, on_queued=None, on_finished=None):
+    # Registers the Converter interface for `service` on the connection and
+    # sends its progress as signals. `service` may also be a function
+    # returning one, called on the first method call, so the GUI only loads
+    # the mappings once a job comes in. on_queued runs on the main loop after
+    # a job was accepted, on_finished on the worker thread. Returns the
+    # registration id.
+    from gi.repository import Gio, GLib
+
+    node = Gio.DBusNodeInfo.new_for_xml(INTERFACE_XML)
+    state = {"service": None, "factory": service}
+
+    def to_variant(value):
+        if isinstance(value, bool): return GLib.Variant("b", value)
+        if isinstance(value, int): return GLib.Variant("x", value)
+        if isinstance(value, float): return GLib.Variant("d", value)
+        return GLib.Variant("s", value)
+
+    def get_service():
+        if state["service"] is None:
+            try: created = state["factory"]()
+            except (OSError, ValueError) as e: raise ServiceError("ConfigError", f"Cannot load mappings: {e}")
+            connect(created)
+        return state["service"]
+
+    def on_method_call(connection, sender, path, interface, method, params, invocation):
+        try:
+            service = get_service()
+            if method == "Submit":
+                job_id = service.submit(params.get_child_value(0).get_string(), unpack_options(params.get_child_value(1)))
+                if on_queued: on_queued(job_id)
+                result = GLib.Variant("(s)", (job_id,))
+            elif method == "GetStatus":
+                status = {k: to_variant(v) for k, v in service.status(params.unpack()[0]).items()}
+                result = GLib.Variant("(a{sv})", (status,))
+            elif method == "Cancel":
+                result = GLib.Variant("(b)", (service.cancel(params.unpack()[0]),))
+            else:
+                result = GLib.Variant("(as)", (service.list_jobs(),))
+        except ServiceError as e:
+            invocation.return_dbus_error(f"{ERROR_PREFIX}.{e.name}", str(e))
+            return
+        invocation.return_value(result)
+
+    def on_get_property(connection, sender, path, interface, name):
+        # Jobs waiting to run; none before the service was created.
+        return GLib.Variant("u", state["service"].queue.qsize() if state["service"] else 0)
+
+    def emit(signal, signature, values):
+        # GDBusConnection is thread safe, so the worker emits directly.
+        connection.emit_signal(None, object_path, INTERFACE_NAME, signal, GLib.Variant(signature, values))
+
+    def finished(job):
+        emit("Finished", "(sss)", (job.id, job.state, job.output or job.error or ""))
+        if on_finished: on_finished(job)
+
+    def connect(service):
+        service.on_progress = lambda job, phase, done, total: emit("Progress", "(ssuu)", (job.id, phase, done, total))
+        service.on_finished = finished
+        state["service"] = service
+
+    if not callable(service): connect(service)
+    return connection.register_object(object_path, node.interfaces[0], on_method_call, on_get_property, None)
+
+def main(argv=None):
+    from gi.repository import Gio, GLib
+
+    class ServiceApplication(Gio.Application):
+        # Headless: held while jobs are queued or running, exits after
+        # INACTIVITY_TIMEOUT without work.
+
+        def __init__(self):
+            super().__init__(application_id=BUS_NAME, flags=Gio.ApplicationFlags.IS_SERVICE)
+            self.set_inactivity_timeout(INACTIVITY_TIMEOUT)
+            self.registration = None
+
+        def do_dbus_register(self, connection, object_path):
+            print(f"Loading mappings from {default_config_dir()}...")
+            service = ConversionService(default_config_dir())
+            self.registration = export_service(connection, OBJECT_PATH, service,
+                                               lambda job_id: self.hold(),
+                                               lambda job: GLib.idle_add(self.release))
+            print(f"Isomorphicon service ready on {BUS_NAME} {OBJECT_PATH}")
+            return Gio.Application.do_dbus_register(self, connection, object_path)
+
+        def do_dbus_unregister(self, connection, object_path):
+            if self.registration: connection.unregister_object(self.registration)
+            Gio.Application.do_dbus_unregister(self, connection, object_path)
+
+        def do_activate(self):
+            pass
+
+    app = ServiceApplication()
+    return app.run([sys.argv[0]] + list(argv if argv is not None else sys.argv[1:]))
+
+if __name__ == "__main__":
+    sys.exit(main())
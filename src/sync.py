@@ -0,0 +1,120 @@
+import json
+import os
+from transcode import link_many, new_job_stats
+
+# Incremental output: the theme folder keeps a manifest describing how every
+# file in it was produced (source fingerprint, encode settings and, for extra
+# names, the file they link to) plus its size and mtime when written. A later
+# run only rewrites targets whose description changed or whose file was
+# touched since, and deletes the targets that are no longer planned.
+
+MANIFEST_NAME = ".isomorphicon-manifest.json"
+MANIFEST_VERSION = 1
+
+def load_manifest(theme_root):
+    try:
+        with open(os.path.join(theme_root, MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION: return {}
+    return manifest["targets"]
+
+def save_manifest(theme_root, targets):
+    path = os.path.join(theme_root, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "targets": targets}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def disk_state(path):
+    try: st = os.lstat(path)
+    except OSError: return None
+    return [st.st_size, st.st_mtime_ns]
+
+class ThemeSync:
+    def __init__(self, theme_root):
+        self.theme_root = theme_root
+        self.manifest = load_manifest(theme_root)
+        self.expected = {}
+        self.pending = []
+        self.stats = {"unchanged": 0, "written": 0, "relinked": 0, "removed": 0}
+
+    def relpath(self, dest_folder, name):
+        return os.path.relpath(os.path.join(dest_folder, f"{name}.png"), self.theme_root)
+
+    def is_current(self, rel):
+        entry = self.manifest.get(rel)
+        if not entry or entry["signature"] != self.expected[rel]: return False
+        return entry["state"] == disk_state(os.path.join(self.theme_root, rel))
+
+    def plan(self, write_plan, fingerprints, policy, link_mode, levels=None):
+        # Returns (jobs to run, relinks) and deletes stale targets. The plan
+        # must already be deduped. levels are run_plan's size folders. A job
+        # whose first target is current in every folder only needs its other
+        # names linked again; otherwise it runs in full.
+        jobs = []
+        relinks = []
+        for job in write_plan:
+            source_path, dest_folder, names, normalize, cache_path = job
+            job_levels = (levels.get(dest_folder) if levels else None) or [(None, dest_folder)]
+            folders = [folder for size, folder in job_levels]
+            for level, folder in enumerate(folders):
+                # A smaller size may be a link into any larger size folder.
+                settings = f"{int(normalize)}:{policy}"
+                if level: settings += ":" + ",".join(str(size) for size, _ in job_levels[:level])
+                canonical = self.relpath(folder, names[0])
+                for i, name in enumerate(names):
+                    self.expected[self.relpath(folder, name)] = {
+                        "source": fingerprints[source_path],
+                        "settings": settings,
+                        "canonical": canonical if i else None,
+                        "link_mode": link_mode if i else None
+                    }
+
+            if not all(self.is_current(self.relpath(folder, names[0])) for folder in folders):
+                jobs.append(job)
+                for folder in folders:
+                    self.pending.extend(self.relpath(folder, name) for name in names)
+                self.stats["written"] += len(names) * len(folders)
+                continue
+            for folder in folders:
+                stale_links = [name for name in names[1:] if not self.is_current(self.relpath(folder, name))]
+                if stale_links:
+                    relinks.append((os.path.join(folder, f"{names[0]}.png"), folder, stale_links))
+                    self.pending.extend(self.relpath(folder, name) for name in stale_links)
+                    self.stats["relinked"] += len(stale_links)
+                self.stats["unchanged"] += len(names) - len(stale_links)
+
+        for rel in list(self.manifest):
+            if rel in self.expected: continue
+            path = os.path.join(self.theme_root, rel)
+            if os.path.lexists(path):
+                try: os.unlink(path)
+                except OSError as e: print(f"Could not remove {path}: {e}")
+            del self.manifest[rel]
+            self.stats["removed"] += 1
+        return jobs, relinks
+
+    def relink(self, relinks, link_mode):
+        failures = []
+        for canonical_path, dest_folder, names in relinks:
+            link_many(canonical_path, dest_folder, names, link_mode, [], failures, new_job_stats())
+        return failures
+
+    def commit(self, failures):
+        failed = {os.path.relpath(path, self.theme_root) for path, error in failures}
+        for rel in self.pending:
+            state = disk_state(os.path.join(self.theme_root, rel))
+            if rel in failed or state is None:
+                self.manifest.pop(rel, None)
+            else:
+                self.manifest[rel] = {"signature": self.expected[rel], "state": state}
+        self.pending = []
+        save_manifest(self.theme_root, self.manifest)
+
+    def abort(self):
+        # Targets that were due to be written may be half done; forget them.
+        for rel in self.pending: self.manifest.pop(rel, None)
+        self.pending = []
+        save_manifest(self.theme_root, self.manifest)
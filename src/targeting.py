@@ -0,0 +1,102 @@
+import os
+
+# Installed-apps targeting: the icon names the desktop files on this system
+# ask for, from their Icon= and StartupWMClass= keys. A conversion given
+# these names skips the mapped targets and leftover drawables that no
+# installed application would ever look up.
+# Inside the Flatpak sandbox the host's folders are read through /run/host
+# and the read-only permissions in the manifest.
+
+HOST_ROOT = "/run/host"
+FLATPAK_EXPORTS = "/var/lib/flatpak/exports/share"
+DESKTOP_KEYS = ("Icon", "StartupWMClass")
+ICON_EXTENSIONS = (".png", ".svg", ".xpm")
+
+def in_flatpak():
+    return os.path.exists("/.flatpak-info")
+
+def data_dirs():
+    # XDG data dirs in lookup order, then the Flatpak exports in case the
+    # session doesn't list them.
+    home = os.path.expanduser("~")
+    if in_flatpak():
+        data_home = os.environ.get("HOST_XDG_DATA_HOME") or os.path.join(home, ".local", "share")
+        system = [HOST_ROOT + d for d in ("/usr/local/share", "/usr/share")]
+    else:
+        data_home = os.environ.get("XDG_DATA_HOME") or os.path.join(home, ".local", "share")
+        system = (os.environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share").split(":")
+    dirs = []
+    for d in [data_home] + system + [os.path.join(data_home, "flatpak", "exports", "share"), FLATPAK_EXPORTS]:
+        if d and d not in dirs: dirs.append(d)
+    return dirs
+
+def read_desktop_entry(path):
+    # Returns (hidden, [(key, value)...]) for DESKTOP_KEYS in the
+    # [Desktop Entry] and [Desktop Action ...] groups.
+    hidden = False
+    values = []
+    group = None
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("["):
+                    group = line
+                    continue
+                if not group or not group.startswith("[Desktop "): continue
+                key, sep, value = line.partition("=")
+                key, value = key.strip(), value.strip()
+                if not sep or not value: continue
+                if key == "Hidden" and group == "[Desktop Entry]": hidden = value == "true"
+                elif key in DESKTOP_KEYS: values.append((key, value))
+    except OSError:
+        pass
+    return hidden, values
+
+def icon_names(key, value):
+    if key == "StartupWMClass": return {value, value.lower()}
+    # An absolute Icon= is a file, never looked up in a theme.
+    if os.path.isabs(value): return set()
+    if value.lower().endswith(ICON_EXTENSIONS): value = value[:-4]
+    return {value}
+
+def installed_icon_names(dirs=None):
+    # A desktop file shadows the ones with the same id in later data dirs,
+    # and a Hidden one removes the application altogether.
+    if dirs is None: dirs = data_dirs()
+    names = set()
+    seen = set()
+    for data_dir in dirs:
+        apps_dir = os.path.join(data_dir, "applications")
+        for root, subdirs, files in os.walk(apps_dir):
+            subdirs.sort()
+            for f in sorted(files):
+                if not f.endswith(".desktop"): continue
+                path = os.path.join(root, f)
+                desktop_id = os.path.relpath(path, apps_dir).replace(os.sep, "-")
+                if desktop_id in seen: continue
+                seen.add(desktop_id)
+                hidden, values = read_desktop_entry(path)
+                if hidden: continue
+                for key, value in values: names |= icon_names(key, value)
+    return names
+
+def prune_jobs(jobs, wanted):
+    # Drops the target names not in wanted, and the jobs left without any.
+    pruned = []
+    for job in jobs:
+        names = [name for name in job[2] if name in wanted]
+        if names: pruned.append(job[:2] + (names,) + job[3:])
+    return pruned
+
+def prune_matches(matches, wanted):
+    # Match records as written: targets not in wanted are gone, and so are
+    # the matches left without any.
+    pruned = []
+    for record in matches:
+        if record["phase"] == "FAILED":
+            pruned.append(record)
+            continue
+        targets = [t for t in record["targets"] if t in wanted]
+        if targets: pruned.append(dict(record, targets=targets))
+    return pruned
@@ -0,0 +1,541 @@
+import io
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from apkreader import open_source, read_source
+from cache import store_data, sized_path
+from progress import ProgressTracker, ConversionCancelled
+
+# A write plan is a list of jobs: (source_path, dest_folder, target_names, normalize, cache_path).
+# normalize=True converts to RGBA before encoding, which is what mapped icons get;
+# leftover drawables are re-saved in their original mode. When cache_path holds
+# a previously encoded PNG it is copied instead of decoding the source again.
+#
+# A job can also fill several size folders (its levels, largest first, the
+# first being dest_folder): the source is decoded once and each level is
+# downscaled from the one before it. Levels the image already fits in are
+# linked to the larger file instead of written again.
+#
+# A memory-bounded run (low_memory) scales large images down strip by strip
+# on their way to RGBA, with the same result, and frees the full size pixels
+# right away. With several processes, a shared MemoryBudget also caps the
+# decoded bytes they hold together, estimated from the image headers.
+
+# How extra target names of a job are created once the first one is encoded.
+# A mode falls back to the ones after it when the filesystem refuses it.
+LINK_MODES = ["symlink", "hardlink", "copy"]
+
+# How the first target of a job is produced. "passthrough" copies the source
+# bytes when they already are a PNG of the wanted kind and encodes like
+# "default" otherwise; "fast" and "size" trade output size against CPU time.
+ENCODE_POLICIES = ["default", "passthrough", "fast", "size"]
+PNG_SAVE_OPTIONS = {
+    "default": {},
+    "passthrough": {},
+    "fast": {"compress_level": 1},
+    "size": {"optimize": True}
+}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+MAX_CHUNK = 16
+# Jobs waiting between a pipeline's producer and the encoders, and the
+# chunks each encoding process may have queued.
+PIPELINE_DEPTH = 256
+PIPELINE_CHUNK = 8
+PIPELINE_BACKLOG = 2
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# Modes Pillow can resize with LANCZOS; others are converted to RGBA first.
+SCALABLE_MODES = ("RGBA", "RGB", "LA", "L")
+REDUCING_GAP = 3.0
+STRIP_ROWS = 64
+PREMULTIPLIED_MODES = {"RGBA": "RGBa", "LA": "La"}
+# Full size RGBA copies a decoder holds while loading, for the budget;
+# Pillow's WebP decoder goes through several buffers.
+DECODE_COPIES = {"WEBP": 4}
+
+# The MemoryBudget of a pool's processes, set by their initializer.
+worker_budget = None
+
+def pool_context():
+    # Pool processes start from a fork server instead of forking this process,
+    # which may be the GUI with GTK's threads and locks. spawn where there is
+    # no fork server.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+class MemoryBudget:
+    # Decoded bytes in flight across processes. Only shared with processes
+    # as they start, i.e. through a pool initializer, and they must come
+    # from the same context as the pool.
+
+    def __init__(self, limit, context=None):
+        if context is None: context = pool_context()
+        self.limit = limit
+        self.used = context.RawValue("q", 0)
+        self.changed = context.Condition()
+
+    def acquire(self, cost):
+        # An image larger than the whole budget still runs, but alone.
+        with self.changed:
+            self.changed.wait_for(lambda: self.used.value == 0 or self.used.value + cost <= self.limit)
+            self.used.value += cost
+
+    def release(self, cost):
+        with self.changed:
+            self.used.value -= cost
+            self.changed.notify_all()
+
+def set_worker_budget(budget):
+    global worker_budget
+    worker_budget = budget
+
+def encoder_pool(workers, memory_budget=None):
+    context = pool_context()
+    budget = MemoryBudget(memory_budget, context) if memory_budget else None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=set_worker_budget, initargs=(budget,))
+
+def make_job(source_path, dest_folder, target_names, normalize=True, cache_path=None):
+    return (source_path, dest_folder, list(target_names), normalize, cache_path)
+
+def with_cache_path(job, cache_path):
+    return job[:4] + (cache_path,)
+
+def clear_target(target_path):
+    # Never write through a link left over from a previous run.
+    if os.path.islink(target_path) or os.path.exists(target_path):
+        os.unlink(target_path)
+
+def link_target(canonical_path, target_path, link_mode):
+    clear_target(target_path)
+    error = None
+    for mode in LINK_MODES[LINK_MODES.index(link_mode):]:
+        try:
+            if mode == "symlink":
+                os.symlink(os.path.relpath(canonical_path, os.path.dirname(target_path)), target_path)
+            elif mode == "hardlink":
+                os.link(canonical_path, target_path)
+            else:
+                shutil.copyfile(canonical_path, target_path)
+            return mode
+        except OSError as e:
+            error = e
+    raise error
+
+def new_job_stats():
+    return {"decoded": 0, "passthrough": 0, "scaled": 0, "bytes": 0, "encode_time": 0.0}
+
+def png_passthrough_ok(data, normalize, size=None):
+    # IHDR always follows the signature: bytes 16-23 are the width and height,
+    # 24 and 25 the bit depth and color type, and 8 bit color type 6 is
+    # exactly what convert('RGBA') gives.
+    if len(data) < 29 or not data.startswith(PNG_SIGNATURE) or data[12:16] != b"IHDR": return False
+    if size and max(int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")) > size: return False
+    if not normalize: return True
+    return data[24] == 8 and data[25] == 6
+
+def fit_size(width, height, size):
+    scale = size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def save_png(img, policy):
+    out = io.BytesIO()
+    img.save(out, "PNG", **PNG_SAVE_OPTIONS[policy])
+    return out.getvalue()
+
+def reduce_in_strips(img, factors):
+    # img.reduce(factors), a strip of rows at a time.
+    width, height = img.size
+    reduced = Image.new(img.mode, (-(-width // factors[0]), -(-height // factors[1])))
+    step = factors[1] * STRIP_ROWS
+    for top in range(0, height, step):
+        with img.crop((0, top, width, min(top + step, height))) as strip:
+            reduced.paste(strip.reduce(factors), (0, top // factors[1]))
+    return reduced
+
+def scale_down(img, size, mode):
+    # Same pixels as img.convert(mode).resize(target, LANCZOS,
+    # reducing_gap=REDUCING_GAP) without a second full size copy of img,
+    # which is closed as soon as it isn't needed. Pillow resizes RGBA and LA
+    # premultiplied, and without the reducing step; its horizontal pass goes
+    # row by row, so it can be run on strips. The box reduce of other modes
+    # is local as well.
+    width, height = img.size
+    target = fit_size(width, height, size)
+    if mode in PREMULTIPLIED_MODES:
+        narrow = Image.new(PREMULTIPLIED_MODES[mode], (target[0], height))
+        for top in range(0, height, STRIP_ROWS):
+            with img.crop((0, top, width, min(top + STRIP_ROWS, height))) as strip:
+                narrow.paste(strip.convert(mode).convert(PREMULTIPLIED_MODES[mode]).resize((target[0], strip.height), Image.LANCZOS), (0, top))
+        img.close()
+        return narrow.resize(target, Image.LANCZOS).convert(mode)
+    factors = (max(1, int(width / target[0] / REDUCING_GAP)), max(1, int(height / target[1] / REDUCING_GAP)))
+    if factors == (1, 1): return img.resize(target, Image.LANCZOS)
+    reduced = reduce_in_strips(img, factors)
+    img.close()
+    return reduced.resize(target, Image.LANCZOS, (0, 0, width / factors[0], height / factors[1]))
+
+def decode_image(img, normalize, stats, size=None):
+    # With a size, a larger image is scaled down strip by strip as it is
+    # converted, and its full size pixels are freed at once.
+    img.load()
+    if stats: stats["decoded"] += 1
+    if size and max(img.size) > size:
+        scaled = scale_down(img, size, img.mode if img.mode in SCALABLE_MODES and not normalize else 'RGBA')
+        img.close()
+        img = scaled
+    if normalize and img.mode != 'RGBA': img = img.convert('RGBA')
+    return img
+
+def encode_levels(source_path, normalize=True, policy="default", stats=None, sizes=(None,), low_memory=False):
+    # Returns one PNG per size (largest first, None meaning the source
+    # resolution). A level the image already fits in, other than the first,
+    # gets None: its file is the larger level's.
+    data = None
+    passthrough = False
+    if policy == "passthrough":
+        data = read_source(source_path)
+        passthrough = png_passthrough_ok(data, normalize, sizes[0])
+        if passthrough:
+            if stats: stats["passthrough"] += 1
+            if len(sizes) == 1: return [data]
+
+    with Image.open(io.BytesIO(data) if data is not None else open_source(source_path)) as img:
+        budget = worker_budget if low_memory else None
+        cost = img.width * img.height * 4 * DECODE_COPIES.get(img.format, 1)
+        if budget: budget.acquire(cost)
+        try:
+            current = None
+            dims = img.size
+            outputs = []
+            for i, size in enumerate(sizes):
+                if size and max(dims) > size:
+                    if current is None: current = decode_image(img, normalize, stats, size if low_memory else None)
+                    # Modes like P can only be resized with NEAREST.
+                    if current.mode not in SCALABLE_MODES: current = current.convert('RGBA')
+                    if max(current.size) > size:
+                        current = current.resize(fit_size(*current.size, size), Image.LANCZOS, reducing_gap=REDUCING_GAP)
+                    dims = current.size
+                    if stats and i: stats["scaled"] += 1
+                    outputs.append(save_png(current, policy))
+                elif i == 0 and passthrough:
+                    outputs.append(data)
+                elif i == 0:
+                    current = decode_image(img, normalize, stats)
+                    outputs.append(save_png(current, policy))
+                else:
+                    outputs.append(None)
+                if budget and i == 0 and current is not None:
+                    # Only the largest level's pixels are needed from now on.
+                    if current is not img: img.close()
+                    budget.release(cost)
+                    budget = None
+            return outputs
+        finally:
+            if budget: budget.release(cost)
+
+def link_many(canonical_path, dest_folder, target_names, link_mode, written, failures, stats):
+    for name in target_names:
+        target_path = os.path.join(dest_folder, f"{name}.png")
+        try:
+            if link_target(canonical_path, target_path, link_mode) == "copy":
+                stats["bytes"] += os.path.getsize(target_path)
+            written.append(name)
+        except Exception as e:
+            failures.append((target_path, str(e)))
+
+def write_level(png_data, dest_folder, target_names, link_mode, written, failures, stats):
+    # Writes the first name that works and links the others to it; returns
+    # the written path or None.
+    canonical_path = None
+    for name in target_names:
+        target_path = os.path.join(dest_folder, f"{name}.png")
+        try:
+            if canonical_path:
+                if link_target(canonical_path, target_path, link_mode) == "copy":
+                    stats["bytes"] += os.path.getsize(target_path)
+            else:
+                clear_target(target_path)
+                with open(target_path, "wb") as f:
+                    f.write(png_data)
+                canonical_path = target_path
+                stats["bytes"] += len(png_data)
+            written.append(name)
+        except Exception as e:
+            failures.append((target_path, str(e)))
+    return canonical_path
+
+def read_cached_levels(cache_paths):
+    # An empty entry stands for a level that reuses the larger file.
+    outputs = []
+    for path in cache_paths:
+        with open(path, "rb") as f:
+            outputs.append(f.read() or None)
+        os.utime(path)
+    return outputs
+
+def save_one_source_to_many(source_path, dest_folder, target_names, normalize=True, cache_path=None, link_mode="symlink", policy="default", levels=None, low_memory=False):
+    # levels lists (size, folder) pairs largest first, starting with
+    # dest_folder; without it the source is only written to dest_folder.
+    written = []
+    failures = []
+    stats = new_job_stats()
+    if not levels: levels = [(None, dest_folder)]
+    cache_paths = None
+    if cache_path: cache_paths = [cache_path] + [sized_path(cache_path, [size for size, folder in levels[:i + 1]]) for i in range(1, len(levels))]
+
+    outputs = None
+    if cache_paths and all(os.path.exists(path) for path in cache_paths):
+        try: outputs = read_cached_levels(cache_paths)
+        except OSError: outputs = None
+
+    if outputs is None:
+        try:
+            start = time.process_time()
+            outputs = encode_levels(source_path, normalize, policy, stats, [size for size, folder in levels], low_memory)
+            stats["encode_time"] += time.process_time() - start
+        except Exception as e:
+            for size, folder in levels:
+                for name in target_names:
+                    failures.append((os.path.join(folder, f"{name}.png"), str(e)))
+            return written, failures, stats
+        if cache_paths:
+            try:
+                for path, png_data in zip(cache_paths, outputs): store_data(path, png_data or b"")
+            except OSError: pass
+
+    larger_path = None
+    for (size, folder), png_data in zip(levels, outputs):
+        if png_data is not None:
+            larger_path = write_level(png_data, folder, target_names, link_mode, written, failures, stats)
+        elif larger_path:
+            link_many(larger_path, folder, target_names, link_mode, written, failures, stats)
+        else:
+            failures.extend((os.path.join(folder, f"{name}.png"), "larger size was not written") for name in target_names)
+    return written, failures, stats
+
+def run_job(job, link_mode="symlink", policy="default", levels=None, low_memory=False):
+    written, failures, stats = save_one_source_to_many(*job, link_mode=link_mode, policy=policy, levels=levels.get(job[1]) if levels else None, low_memory=low_memory)
+    # Leftover drawables are the jobs that keep their mode.
+    stats["kind"] = "mapped" if job[3] else "remaining_icons"
+    stats["rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return written, failures, stats
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def dedupe_plan(plan):
+    # When two jobs target the same file the later one wins, as it did when
+    # jobs were written one after another.
+    seen = set()
+    deduped = []
+    for source_path, dest_folder, target_names, normalize, cache_path in reversed(plan):
+        names = []
+        for name in reversed(target_names):
+            target_path = os.path.join(dest_folder, f"{name}.png")
+            if target_path in seen: continue
+            seen.add(target_path)
+            names.append(name)
+        if names: deduped.append((source_path, dest_folder, names[::-1], normalize, cache_path))
+    return deduped[::-1]
+
+def run_jobs(chunk, link_mode="symlink", policy="default", levels=None, low_memory=False):
+    return [run_job(job, link_mode, policy, levels, low_memory) for job in chunk]
+
+def run_plan(plan, workers=None, link_mode="symlink", metrics=None, progress=None, policy="default", levels=None, memory_budget=None):
+    # levels maps a job's dest_folder to its size folders, see above. A
+    # memory_budget in bytes makes the run memory-bounded.
+    if progress is None: progress = ProgressTracker()
+    plan = dedupe_plan(plan)
+    if workers is None: workers = default_workers()
+    workers = max(1, min(workers, len(plan)))
+
+    low_memory = memory_budget is not None
+    results = []
+    progress.report("encode", 0, len(plan))
+
+    def collect(chunk_results):
+        results.extend(chunk_results)
+        progress.report("encode", len(results), len(plan))
+
+    pool_done = False
+    if workers > 1:
+        # Small chunks keep progress smooth and let a cancel take effect quickly.
+        chunksize = max(1, min(MAX_CHUNK, len(plan) // (workers * 8)))
+        chunks = [plan[i:i + chunksize] for i in range(0, len(plan), chunksize)]
+        try:
+            pool = encoder_pool(workers, memory_budget)
+            try:
+                pending = {pool.submit(run_jobs, chunk, link_mode, policy, levels, low_memory) for chunk in chunks}
+                while pending:
+                    progress.check()
+                    done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                    for future in done: collect(future.result())
+                pool_done = True
+            finally:
+                pool.shutdown(wait=True, cancel_futures=True)
+        except (OSError, NotImplementedError, BrokenProcessPool) as e:
+            print(f"Process pool unavailable ({e}), encoding serially.")
+            results = []
+
+    if not pool_done:
+        for job in plan:
+            progress.check()
+            collect([run_job(job, link_mode, policy, levels, low_memory)])
+
+    written = 0
+    failures = []
+    for job_written, job_failures, job_stats in results:
+        written += len(job_written)
+        failures.extend(job_failures)
+        if metrics: metrics.add_encode_stats(job_stats)
+    return written, failures
+
+def run_pipeline(produce, workers=None, link_mode="symlink", metrics=None, progress=None, policy="default", levels=None, memory_budget=None):
+    # Streaming run_plan: produce(emit) runs on its own thread and calls
+    # emit(job) as soon as each job is known, while this thread hands the jobs
+    # to the encoders. Both ends are bounded, so a slow encoder pauses the
+    # producer instead of piling jobs up. Jobs are deduped as dedupe_plan
+    # would; a target an earlier job already took is dropped, as the producer
+    # only repeats targets within a job. Returns (produce's result, written, failures).
+    # The phases recorded are "produce", the producer's own time without
+    # waiting for a full queue (its match phases are recorded as well), and
+    # "encode", from the first job to the last result, with this thread's CPU.
+    if progress is None: progress = ProgressTracker()
+    if workers is None: workers = default_workers()
+    low_memory = memory_budget is not None
+    jobs = queue.Queue(maxsize=PIPELINE_DEPTH)
+    stop = threading.Event()
+    produced = {"blocked": 0.0}
+    seen = set()
+    end = object()
+
+    def emit(job):
+        if not job[2]: return
+        names = []
+        for name in dedupe_plan([job])[0][2]:
+            target_path = os.path.join(job[1], f"{name}.png")
+            if target_path in seen: continue
+            seen.add(target_path)
+            names.append(name)
+        if not names: return
+        job = job[:2] + (names,) + job[3:]
+        try:
+            jobs.put_nowait(job)
+            return
+        except queue.Full:
+            pass
+        blocked = time.perf_counter()
+        try:
+            while True:
+                if stop.is_set(): raise ConversionCancelled()
+                try:
+                    jobs.put(job, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+        finally:
+            produced["blocked"] += time.perf_counter() - blocked
+
+    def producer():
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try: produced["result"] = produce(emit)
+        except BaseException as e: produced["error"] = e
+        finally:
+            produced["wall"] = time.perf_counter() - wall - produced["blocked"]
+            produced["cpu"] = time.thread_time() - cpu
+            while not stop.is_set():
+                try:
+                    jobs.put(end, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+
+    results = []
+    state = {"total": 0, "producing": True}
+
+    def collect(chunk_results):
+        results.extend(chunk_results)
+        # The producer reports its own phases until every job is known.
+        if not state["producing"]: progress.report("encode", len(results), state["total"])
+
+    def take(block):
+        # Next job from the producer, or None if there is none right now.
+        try: job = jobs.get(timeout=0.1) if block else jobs.get_nowait()
+        except queue.Empty: return None
+        if job is end:
+            if "error" in produced: raise produced["error"]
+            state["producing"] = False
+            progress.report("encode", len(results), state["total"])
+            return None
+        state["total"] += 1
+        if "first" not in state: state["first"] = time.perf_counter()
+        return job
+
+    pool = None
+    if workers > 1:
+        try: pool = encoder_pool(workers, memory_budget)
+        except (OSError, NotImplementedError) as e: print(f"Process pool unavailable ({e}), encoding serially.")
+
+    pending = {}
+    buffer = []
+    cpu = time.thread_time()
+    try:
+        while state["producing"] or buffer or pending:
+            progress.check()
+            while state["producing"] and len(buffer) < PIPELINE_CHUNK:
+                job = take(block=not buffer and not pending)
+                if job is None: break
+                buffer.append(job)
+            if buffer and pool is None:
+                collect(run_jobs(buffer, link_mode, policy, levels, low_memory))
+                buffer = []
+                continue
+            if buffer and len(pending) < workers * PIPELINE_BACKLOG and (len(buffer) >= PIPELINE_CHUNK or not state["producing"] or not pending):
+                try:
+                    pending[pool.submit(run_jobs, buffer, link_mode, policy, levels, low_memory)] = buffer
+                    buffer = []
+                except (OSError, NotImplementedError, RuntimeError, BrokenProcessPool) as e:
+                    print(f"Process pool unavailable ({e}), encoding serially.")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = None
+                    continue
+            if pending:
+                done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        collect(future.result())
+                    except BrokenProcessPool as e:
+                        # Redo what the pool lost and go on without it.
+                        print(f"Process pool unavailable ({e}), encoding serially.")
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = None
+                        buffer = chunk + [job for lost in pending.values() for job in lost] + buffer
+                        pending = {}
+                        break
+    finally:
+        stop.set()
+        if pool: pool.shutdown(wait=True, cancel_futures=True)
+        thread.join()
+
+    if metrics:
+        metrics.add_phase("produce", produced["wall"], produced["cpu"])
+        if "first" in state: metrics.add_phase("encode", time.perf_counter() - state["first"], time.thread_time() - cpu)
+    written = 0
+    failures = []
+    for job_written, job_failures, job_stats in results:
+        written += len(job_written)
+        failures.extend(job_failures)
+        if metrics: metrics.add_encode_stats(job_stats)
+    return produced["result"], written, failures
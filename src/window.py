@@ -1,7 +1,8 @@
 import os
 import threading
-import json
+import time
 from gi.repository import Adw, Gtk, Gio, GLib, Gdk
+from preview import ResultsView
 
 class IsomorphiconWindow(Adw.ApplicationWindow):
     def __init__(self, *args, **kwargs):
@@ -16,6 +17,8 @@ class IsomorphiconWindow(Adw.ApplicationWindow):
             os.makedirs(self.output_folder)
 
         self.selected_apk = None
+        self.tracker = None
+        self.last_progress = 0.0
 
         self.toast_overlay = Adw.ToastOverlay()
         self.set_content(self.toast_overlay)
@@ -30,8 +33,16 @@ class IsomorphiconWindow(Adw.ApplicationWindow):
         about_btn.connect("clicked", self.show_about_dialog)
         header.pack_end(about_btn)
 
+        self.view_stack = Adw.ViewStack(vexpand=True)
+        main_box.append(self.view_stack)
+        header.set_title_widget(Adw.ViewSwitcher(stack=self.view_stack, policy=Adw.ViewSwitcherPolicy.WIDE))
+
         page = Adw.PreferencesPage()
-        main_box.append(page)
+        self.view_stack.add_titled_with_icon(page, "convert", "Convert", "emblem-system-symbolic")
+
+        self.results_view = ResultsView()
+        self.results_page = self.view_stack.add_titled_with_icon(self.results_view, "results", "Icons", "view-grid-symbolic")
+        self.results_page.set_visible(False)
 
         group_input = Adw.PreferencesGroup(title="Input", description="Select Android Icon Pack (.apk)")
         page.add(group_input)
@@ -58,6 +69,50 @@ class IsomorphiconWindow(Adw.ApplicationWindow):
         self.install_switch.set_active(False)
         group_config.add(self.install_switch)
 
+        self.sync_switch = Adw.SwitchRow(title="Update Existing Theme")
+        self.sync_switch.set_subtitle("Only write icons that changed since the last conversion")
+        self.sync_switch.set_active(False)
+        group_config.add(self.sync_switch)
+
+        self.workers_row = Adw.SpinRow.new_with_range(1, os.cpu_count() or 1, 1)
+        self.workers_row.set_title("Parallel Jobs")
+        self.workers_row.set_subtitle("Number of processes used to encode icons")
+        self.workers_row.set_value(os.cpu_count() or 1)
+        group_config.add(self.workers_row)
+
+        self.link_modes = ["symlink", "hardlink", "copy"]
+        self.link_row = Adw.ComboRow(title="Duplicate Icons")
+        self.link_row.set_subtitle("How icons shared by several apps are written")
+        self.link_row.set_model(Gtk.StringList.new(["Symbolic links", "Hard links", "Copies"]))
+        group_config.add(self.link_row)
+
+        self.encode_policies = ["default", "passthrough", "fast", "size"]
+        self.encode_row = Adw.ComboRow(title="Icon Encoding")
+        self.encode_row.set_subtitle("Trade conversion speed against the size of the theme")
+        self.encode_row.set_model(Gtk.StringList.new(["Balanced", "Copy PNGs when possible", "Fastest", "Smallest files"]))
+        group_config.add(self.encode_row)
+
+        self.size_presets = [[], ["32,48,64,128,256,512"], ["32,48,64,128,256,512", "places=512"]]
+        self.sizes_row = Adw.ComboRow(title="Icon Sizes")
+        self.sizes_row.set_subtitle("Smaller copies spare panels and menus from scaling 512px icons")
+        self.sizes_row.set_model(Gtk.StringList.new(["512px only", "32px to 512px", "32px to 512px, folders at 512px"]))
+        group_config.add(self.sizes_row)
+
+        self.installed_switch = Adw.SwitchRow(title="Installed Apps Only")
+        self.installed_switch.set_subtitle("Skip the icons no installed application uses")
+        self.installed_switch.set_active(False)
+        group_config.add(self.installed_switch)
+
+        self.memory_switch = Adw.SwitchRow(title="Limit Memory Use")
+        self.memory_switch.set_subtitle("Decode large icons at reduced size and fewer at a time")
+        self.memory_switch.set_active(False)
+        group_config.add(self.memory_switch)
+
+        self.dedup_switch = Adw.SwitchRow(title="Merge Duplicate Icons")
+        self.dedup_switch.set_subtitle("Link unmapped drawables that look the same instead of writing each one")
+        self.dedup_switch.set_active(False)
+        group_config.add(self.dedup_switch)
+
         group_action = Adw.PreferencesGroup()
         page.add(group_action)
 
@@ -73,6 +128,19 @@ class IsomorphiconWindow(Adw.ApplicationWindow):
         self.run_btn.connect("clicked", self.on_run_clicked)
         vbox_center.append(self.run_btn)
 
+        self.cancel_btn = Gtk.Button(label="Cancel")
+        self.cancel_btn.add_css_class("pill")
+        self.cancel_btn.set_halign(Gtk.Align.CENTER)
+        self.cancel_btn.set_visible(False)
+        self.cancel_btn.connect("clicked", self.on_cancel_clicked)
+        vbox_center.append(self.cancel_btn)
+
+        self.progress_bar = Gtk.ProgressBar()
+        self.progress_bar.set_size_request(300, -1)
+        self.progress_bar.set_show_text(True)
+        self.progress_bar.set_visible(False)
+        vbox_center.append(self.progress_bar)
+
         status_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
         status_box.set_halign(Gtk.Align.CENTER)
 
@@ -113,65 +181,147 @@ class IsomorphiconWindow(Adw.ApplicationWindow):
         self.apk_row.set_sensitive(False)
         self.inherits_row.set_sensitive(False)
         self.install_switch.set_sensitive(False)
+        self.sync_switch.set_sensitive(False)
+        self.workers_row.set_sensitive(False)
+        self.link_row.set_sensitive(False)
+        self.encode_row.set_sensitive(False)
+        self.sizes_row.set_sensitive(False)
+        self.installed_switch.set_sensitive(False)
+        self.memory_switch.set_sensitive(False)
+        self.dedup_switch.set_sensitive(False)
         self.spinner.start()
         self.status_label.set_label("Processing...")
 
+        from progress import ProgressTracker
+        self.tracker = ProgressTracker(self.on_progress)
+        self.last_progress = 0.0
+        self.progress_bar.set_fraction(0)
+        self.progress_bar.set_text("")
+        self.progress_bar.set_visible(True)
+        self.cancel_btn.set_sensitive(True)
+        self.cancel_btn.set_visible(True)
+
         thread = threading.Thread(target=self.run_conversion_process)
         thread.daemon = True
         thread.start()
 
+    def on_cancel_clicked(self, btn):
+        if self.tracker: self.tracker.cancel()
+        self.cancel_btn.set_sensitive(False)
+        self.status_label.set_label("Cancelling...")
+
+    def on_progress(self, phase, done, total):
+        # Called from the conversion thread, often thousands of times per
+        # phase; only hand the UI about ten updates a second.
+        now = time.monotonic()
+        if done < total and done > 0 and now - self.last_progress < 0.1: return
+        self.last_progress = now
+        GLib.idle_add(self.update_progress, phase, done, total)
+
+    def update_progress(self, phase, done, total):
+        from progress import PHASE_LABELS
+        label = PHASE_LABELS.get(phase, phase)
+        if total > 1:
+            self.progress_bar.set_fraction(done / total)
+            self.progress_bar.set_text(f"{label} ({done}/{total})")
+        else:
+            self.progress_bar.pulse()
+            self.progress_bar.set_text(label)
+        if self.tracker and not self.tracker.cancelled:
+            self.status_label.set_label(f"{label}...")
+        return False
+
     def run_conversion_process(self):
         try:
             import converter
+            from cache import ConversionCache
+            from mappingdb import load_mapping_db
 
             config_dir = os.path.join(self.base_path, "Config")
-            mappings_path = os.path.join(config_dir, "mappings.json")
-            synonyms_path = os.path.join(config_dir, "synonyms.json")
-
-            if not os.path.exists(mappings_path):
-                raise FileNotFoundError(f"Missing mappings.json at {mappings_path}")
-
-            theme_name = os.path.splitext(os.path.basename(self.selected_apk))[0]
-            theme_name = "".join([c if c.isalnum() else "_" for c in theme_name]).strip("_")
-
-            with open(mappings_path, 'r') as f:
-                mappings = json.load(f)
-
-            synonyms = {}
-            if os.path.exists(synonyms_path):
-                with open(synonyms_path, 'r') as f:
-                    synonyms = json.load(f)
+            mapping_db = load_mapping_db(config_dir)
+            theme_name = converter.theme_name_from_apk(self.selected_apk)
 
             inherits = self.inherits_row.get_text()
             should_install = self.install_switch.get_active()
-
-            result_path = converter.convert_apk(
+            should_sync = self.sync_switch.get_active()
+            workers = int(self.workers_row.get_value())
+            link_mode = self.link_modes[self.link_row.get_selected()]
+            encode_policy = self.encode_policies[self.encode_row.get_selected()]
+            from dedup import DEFAULT_THRESHOLD
+            dedup_threshold = DEFAULT_THRESHOLD if self.dedup_switch.get_active() else None
+            sizes = converter.parse_sizes(self.size_presets[self.sizes_row.get_selected()])
+            wanted = None
+            if self.installed_switch.get_active():
+                from targeting import installed_icon_names
+                wanted = installed_icon_names()
+                if not wanted: raise RuntimeError("No installed apps were found")
+            from transcode import DEFAULT_MEMORY_BUDGET
+            memory_budget = DEFAULT_MEMORY_BUDGET if self.memory_switch.get_active() else None
+
+            result_path, metrics = converter.convert_apk(
                 self.selected_apk,
-                mappings,
-                synonyms,
+                mapping_db.mappings,
+                mapping_db.synonyms,
                 self.output_folder,
                 theme_name,
                 inherits,
-                install=should_install
+                install=should_install,
+                workers=workers,
+                link_mode=link_mode,
+                encode_policy=encode_policy,
+                dedup_threshold=dedup_threshold,
+                sync=should_sync,
+                sizes=sizes,
+                wanted=wanted,
+                memory_budget=memory_budget,
+                cache=ConversionCache(),
+                mapping_db=mapping_db,
+                progress=self.tracker
             )
 
-            GLib.idle_add(self.on_conversion_finished, True, result_path)
+            print(f"Conversion stats: {metrics.counts}")
+            print(f"Encoding ({encode_policy}): {metrics.images_decoded} decoded, {metrics.images_passed_through} copied, "
+                  f"{metrics.bytes_written} bytes in {metrics.encode_time:.2f}s CPU")
+            if result_path is None and self.tracker.cancelled:
+                GLib.idle_add(self.on_conversion_finished, False, None)
+                return
+            if result_path is None:
+                raise RuntimeError("Conversion failed, see the log for details")
+
+            GLib.idle_add(self.on_conversion_finished, True, result_path, metrics.matches)
 
         except Exception as e:
             print(f"Conversion Error: {e}")
             GLib.idle_add(self.on_conversion_finished, False, str(e))
 
-    def on_conversion_finished(self, success, message):
+    def on_conversion_finished(self, success, message, matches=None):
         self.spinner.stop()
         self.run_btn.set_sensitive(True)
         self.apk_row.set_sensitive(True)
         self.inherits_row.set_sensitive(True)
         self.install_switch.set_sensitive(True)
-
-        if success:
+        self.sync_switch.set_sensitive(True)
+        self.workers_row.set_sensitive(True)
+        self.link_row.set_sensitive(True)
+        self.encode_row.set_sensitive(True)
+        self.sizes_row.set_sensitive(True)
+        self.installed_switch.set_sensitive(True)
+        self.memory_switch.set_sensitive(True)
+        self.dedup_switch.set_sensitive(True)
+        self.cancel_btn.set_visible(False)
+        self.progress_bar.set_visible(False)
+
+        if message is None:
+            self.status_label.set_label("Cancelled")
+            self.toast_overlay.add_toast(Adw.Toast.new("Conversion cancelled"))
+        elif success:
             self.status_label.set_label("Completed")
+            self.results_view.show_results(matches, message)
+            self.results_page.set_visible(True)
             toast = Adw.Toast.new(f"Success! Output: {message}")
             toast.set_timeout(5)
+            toast.set_button_label("Show Icons")
+            toast.connect("button-clicked", lambda t: self.view_stack.set_visible_child_name("results"))
             self.toast_overlay.add_toast(toast)
         else:
             self.status_label.set_label("Error")
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SRC_DIR = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    # Keeps conversions away from the real ~/.cache/isomorphicon.
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+@pytest.fixture(scope="session")
+def synthetic_apk(tmp_path_factory):
+    import synthpack
+    packages = synthpack.load_packages(os.path.join(SRC_DIR, "Config", "mappings.json"))
+    entries = synthpack.build_pack(drawables=40, components=30, packages=packages)
+    return synthpack.write_apk(entries, str(tmp_path_factory.mktemp("apk") / "synthetic.apk"))
@@ -0,0 +1,19 @@
+import apkreader
+
+def test_archive_stays_open_for_other_holder(synthetic_apk):
+    # Two conversions of the same APK, as the GUI and the D-Bus service can run.
+    apkreader.hold_archive(synthetic_apk)
+    apkreader.hold_archive(synthetic_apk)
+    archive = apkreader.get_archive(synthetic_apk)
+    names = archive.namelist()
+
+    apkreader.close_archive(synthetic_apk)
+    assert apkreader.get_archive(synthetic_apk) is archive
+    assert archive.read(names[0])
+
+    apkreader.close_archive(synthetic_apk)
+    assert archive.fp is None
+    # The next reader opens it again.
+    reopened = apkreader.get_archive(synthetic_apk)
+    assert reopened is not archive
+    apkreader.close_archive(synthetic_apk)
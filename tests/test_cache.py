@@ -0,0 +1,29 @@
+import os
+
+from cache import ConversionCache
+
+def test_json_round_trip(tmp_path):
+    cache = ConversionCache(str(tmp_path))
+    assert cache.store_json("plan", "ab12", {"jobs": [1, 2]})
+    assert cache.load_json("plan", "ab12") == {"jobs": [1, 2]}
+    assert cache.load_json("plan", "cd34") is None
+
+def test_unwritable_cache_is_skipped(tmp_path):
+    # A file where the cache folder should be makes every write fail.
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    cache = ConversionCache(str(blocker / "isomorphicon"))
+    assert not cache.store_json("index", "ab12", {"entries": []})
+    assert cache.load_json("index", "ab12") is None
+    assert cache.evict() == 0
+
+def test_conversion_survives_unwritable_cache(synthetic_apk, tmp_path):
+    import converter
+    from mappingdb import load_mapping_db, default_config_dir
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    db = load_mapping_db(default_config_dir())
+    result, metrics = converter.convert_apk(synthetic_apk, db.mappings, db.synonyms, str(tmp_path / "out"), "Synthetic",
+                                            "hicolor", workers=1, cache=ConversionCache(str(blocker / "isomorphicon")),
+                                            mapping_db=db)
+    assert result and os.path.isfile(os.path.join(result, "index.theme"))
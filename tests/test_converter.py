@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+import converter
+from mappingdb import load_mapping_db, default_config_dir
+from progress import ProgressTracker
+
+@pytest.fixture(scope="module")
+def mapping_db():
+    return load_mapping_db(default_config_dir())
+
+def convert(apk, db, out, **kwargs):
+    return converter.convert_apk(apk, db.mappings, db.synonyms, str(out), "Synthetic", "hicolor", workers=1, mapping_db=db, **kwargs)
+
+def tree(root):
+    return sorted(os.path.relpath(os.path.join(d, f), root) for d, dirs, files in os.walk(root) for f in files + dirs)
+
+def test_cancel_keeps_previous_output(synthetic_apk, mapping_db, tmp_path):
+    result, metrics = convert(synthetic_apk, mapping_db, tmp_path)
+    assert result == os.path.join(tmp_path, "Synthetic")
+    before = tree(result)
+
+    def cancel_when_encoding(phase, done, total):
+        if phase == "encode": tracker.cancel()
+    tracker = ProgressTracker(cancel_when_encoding)
+    result, metrics = convert(synthetic_apk, mapping_db, tmp_path, progress=tracker)
+    assert result is None
+    assert tree(os.path.join(tmp_path, "Synthetic")) == before
+    assert sorted(os.listdir(tmp_path)) == ["Synthetic"]
+
+def test_parse_sizes():
+    assert converter.parse_sizes(None) is None
+    assert converter.parse_sizes([]) is None
+    assert converter.parse_sizes(["32,48, 512"]) == {"apps": [32, 48, 512], "places": [32, 48, 512]}
+    # A category spec overrides the shared list, in any order.
+    assert converter.parse_sizes(["places=512", "32,512"]) == {"apps": [32, 512], "places": [512]}
+    assert converter.parse_sizes(["apps=64,128"]) == {"apps": [64, 128], "places": [converter.TARGET_SIZE]}
+    assert converter.parse_sizes(["32,,64,"]) == {"apps": [32, 64], "places": [32, 64]}
+
+@pytest.mark.parametrize("spec", ["", ",", "0,512", "-32", "big", "32;64", "mimetypes=64", "apps="])
+def test_parse_sizes_rejects(spec):
+    with pytest.raises(ValueError):
+        converter.parse_sizes([spec])
+
+def test_theme_sizes():
+    assert converter.theme_sizes(None) == {"apps": [512], "places": [512]}
+    assert converter.theme_sizes(converter.parse_sizes(["32,512,32,64"])) == {"apps": [512, 64, 32], "places": [512, 64, 32]}
+    levels = converter.size_levels("/t", converter.theme_sizes(converter.parse_sizes(["places=512", "64,256"])))
+    assert levels == {
+        "/t/apps/256x256": [(256, "/t/apps/256x256"), (64, "/t/apps/64x64")],
+        "/t/places/512x512": [(512, "/t/places/512x512")]
+    }
+
+def read_tree(root):
+    files = {}
+    for d, dirs, names in os.walk(root):
+        for name in names:
+            if name == "icon-theme.cache": continue
+            path = os.path.join(d, name)
+            with open(path, "rb") as f: files[os.path.relpath(path, root)] = f.read()
+    return files
+
+def test_cached_sizes_match_uncached(synthetic_apk, mapping_db, tmp_path):
+    # Smaller sizes are scaled from the size above them, so the cache must not
+    # hand one size list the icons another list produced.
+    from cache import ConversionCache
+    cache = ConversionCache(str(tmp_path / "cache"))
+    for specs in (["512,64,32"], ["512,48,32"]):
+        convert(synthetic_apk, mapping_db, tmp_path / "warm", cache=cache, sizes=converter.parse_sizes(specs))
+    sizes = converter.parse_sizes(["512,64,48,32"])
+    cached, metrics = convert(synthetic_apk, mapping_db, tmp_path / "cached", cache=cache, sizes=sizes)
+    fresh, metrics = convert(synthetic_apk, mapping_db, tmp_path / "fresh", sizes=sizes)
+    assert read_tree(cached) == read_tree(fresh)
+    assert any(path.startswith("apps/48x48/") for path in read_tree(fresh))
+
+APPFILTER = b"""<?xml version="1.0" encoding="utf-8"?>
+<resources>
+    <iconback img1="iconback" img2="iconback_alt" />
+    <iconmask img1="iconmask" />
+    <iconupon img1="" />
+    <scale factor="0.85" />
+    <item component="ComponentInfo{org.mozilla.firefox/org.mozilla.firefox.App}" drawable="firefox" />
+    <item component="ComponentInfo{org.mozilla.firefox/org.mozilla.firefox.Other}" drawable="@drawable/firefox_alt" />
+    <item component="ComponentInfo{org.mozilla.firefox/org.mozilla.firefox.App}" drawable="firefox" />
+    <item component="ComponentInfo{com.google.android.calendar/com.android.calendar.AllInOneActivity}" drawable="calendar" />
+    <calendar component="ComponentInfo{com.google.android.calendar/com.android.calendar.AllInOneActivity}" prefix="calendar_" />
+    <calendar component="ComponentInfo{com.broken/com.broken.Main}" />
+</resources>
+"""
+
+def test_parse_appfilter():
+    extras = {}
+    candidates = converter.parse_appfilter(APPFILTER, extras)
+    assert candidates == {"org.mozilla.firefox": {"firefox": None, "firefox_alt": None}, "com.google.android.calendar": {"calendar": None}}
+    assert list(candidates["org.mozilla.firefox"]) == ["firefox", "firefox_alt"]
+    assert extras == {
+        "calendar": {"com.google.android.calendar": "calendar_"},
+        "iconback": ["iconback", "iconback_alt"],
+        "iconmask": ["iconmask"],
+        "iconupon": [],
+        "scale": 0.85
+    }
+    assert converter.parse_appfilter(APPFILTER) == candidates
+
+def test_appfilter_extras_reach_metrics(synthetic_apk, mapping_db, tmp_path):
+    # synthpack writes an iconback and a scale; a cached plan keeps them.
+    from cache import ConversionCache
+    cache = ConversionCache(str(tmp_path / "cache"))
+    for run in ("fresh", "cached"):
+        result, metrics = convert(synthetic_apk, mapping_db, tmp_path / run, cache=cache)
+        assert metrics.appfilter["iconback"] == ["iconback"] and metrics.appfilter["scale"] == 0.85, run
+        assert metrics.to_dict()["appfilter"] == metrics.appfilter
+        assert ("xml_parse" in metrics.phases) == (run == "fresh")
@@ -0,0 +1,83 @@
+import os
+import struct
+
+import iconcache
+
+def reference_hash(name):
+    # GTK's icon_name_hash: signed chars folded into a guint32 as h * 31 + c.
+    h = 0
+    for i, b in enumerate(name.encode("utf-8")):
+        c = (b - 256 if b > 127 else b) & 0xFFFFFFFF
+        h = c if i == 0 else (h * 31 + c) & 0xFFFFFFFF
+    return h
+
+def test_icon_name_hash():
+    assert iconcache.icon_name_hash("") == 0
+    assert iconcache.icon_name_hash("a") == 97
+    assert iconcache.icon_name_hash("ab") == 97 * 31 + 98
+    for name in ["firefox", "org.gnome.Nautilus", "café", "日本"]:
+        assert iconcache.icon_name_hash(name) == reference_hash(name)
+    assert iconcache.icon_name_hash("é") == (0xFFFFFFC3 * 31 + 0xFFFFFFA9) & 0xFFFFFFFF
+
+def test_bucket_count_is_odd_and_prime():
+    for n in [0, 1, 2, 10, 100, 3000]:
+        count = iconcache.bucket_count(n)
+        assert count >= max(n // 3, 1) and count % 2 == 1
+        assert all(count % d for d in range(3, int(count ** 0.5) + 1))
+
+def test_layout_of_a_single_icon():
+    data = iconcache.build_icon_cache(["apps/512x512"], {"a": [(0, 4)]})
+    expected = b"".join([
+        struct.pack(">HHII", 1, 0, 12, 48),   # header
+        struct.pack(">II", 1, 20),            # one bucket, pointing at the icon
+        struct.pack(">III", 0xFFFFFFFF, 32, 36),
+        b"a\0\0\0",
+        struct.pack(">IHHI", 1, 0, 4, 0),     # image list
+        struct.pack(">II", 1, 56),            # directory list
+        b"apps/512x512\0\0\0\0"
+    ])
+    assert data == expected
+
+def test_parse_round_trip():
+    directories = ["apps/512x512", "places/512x512"]
+    icons = {f"icon{i}": [(i % 2, 4)] for i in range(50)}
+    icons["both"] = [(0, 4), (1, 6)]
+    data = iconcache.build_icon_cache(directories, icons)
+    assert len(data) % 4 == 0
+    assert iconcache.parse_icon_cache(data) == (directories, icons)
+
+def make_theme(root, icons):
+    with open(os.path.join(root, "index.theme"), "w") as f:
+        f.write("[Icon Theme]\nName=Test\nDirectories=apps/512x512,places/512x512\n\n"
+                "[apps/512x512]\nSize=512\n\n[places/512x512]\nSize=512\n")
+    for rel in icons:
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f: f.write(b"png")
+
+def test_write_and_validate(tmp_path):
+    root = str(tmp_path)
+    make_theme(root, ["apps/512x512/firefox.png", "apps/512x512/firefox.svg", "places/512x512/folder.png", "apps/512x512/notes.txt"])
+    iconcache.write_icon_cache(root)
+    assert iconcache.validate_icon_cache(root) == []
+    directories, icons = iconcache.read_icon_cache(os.path.join(root, iconcache.CACHE_NAME))
+    assert directories == ["apps/512x512", "places/512x512"]
+    assert icons == {"firefox": [(0, 6)], "folder": [(1, 4)]}
+
+def test_rewrite_lists_changed_directories_again(tmp_path):
+    root = str(tmp_path)
+    make_theme(root, ["apps/512x512/firefox.png", "places/512x512/folder.png"])
+    cache_path = iconcache.write_icon_cache(root)
+    # Push the cache's mtime past the folders', as a later run would find it.
+    for rel in ["apps/512x512", "places/512x512"]:
+        os.utime(os.path.join(root, rel), ns=(1, 1))
+    os.utime(cache_path, ns=(2, 2))
+
+    with open(os.path.join(root, "apps/512x512/thunderbird.png"), "wb") as f: f.write(b"png")
+    # An unchanged folder keeps its cached entries without being scanned.
+    with open(os.path.join(root, "places/512x512/unseen.png"), "wb") as f: f.write(b"png")
+    os.utime(os.path.join(root, "places/512x512"), ns=(1, 1))
+    assert any("not in the cache" in problem for problem in iconcache.validate_icon_cache(root))
+    iconcache.write_icon_cache(root)
+    directories, icons = iconcache.read_icon_cache(cache_path)
+    assert sorted(icons) == ["firefox", "folder", "thunderbird"]
@@ -0,0 +1,64 @@
+import os
+import random
+
+import pytest
+
+import synthpack
+from mappingdb import load_mapping_db, default_config_dir
+from matchindex import MatchIndex, strip_name, tokenize, prepare_wanted, score_prepared
+
+SCORE_THRESHOLD = 50
+
+def calculate_file_score(filename, wanted_list):
+    clean_fname = strip_name(filename)
+    return score_prepared(clean_fname, tokenize(clean_fname), prepare_wanted(wanted_list))
+
+def full_scan(available_files, wanted_names):
+    # The scored fallback as it was before the index: every file, in order.
+    best_score = 0
+    best_file_path = None
+    for fname, fpath in available_files.items():
+        score = calculate_file_score(fname, wanted_names)
+        if score > best_score:
+            best_score = score
+            best_file_path = fpath
+        elif score == best_score and score > 0:
+            if len(fname) < len(os.path.basename(best_file_path)):
+                best_file_path = fpath
+    return best_file_path, best_score
+
+@pytest.fixture(scope="module")
+def mapping_db():
+    return load_mapping_db(default_config_dir())
+
+def accepted(result):
+    # The converter only takes a scored match from 50 points up; below that
+    # the index may skip candidates the full scan still scores.
+    path, score = result
+    return (path, score) if score >= SCORE_THRESHOLD else (None, 0)
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_same_winner_as_full_scan(mapping_db, seed):
+    rng = random.Random(seed)
+    packages = list(mapping_db.entries)
+    names = synthpack.drawable_names(rng, packages, 600, 0.3)
+    # Short names and acronyms exercise the paths the n-gram lookup skips.
+    names += ["ff", "gm", "vlc", "a", "x_y", "chrome-beta", "icon_", "ic_ic_maps"]
+    available_files = {name: f"/res/{name}.png" for name in names}
+    index = MatchIndex(available_files)
+
+    matched = 0
+    for key in packages:
+        criteria = mapping_db.entries[key]["criteria"]
+        expected = accepted(full_scan(available_files, criteria))
+        assert accepted(index.best_match(criteria)) == expected, key
+        assert accepted(index.best_match_prepared(mapping_db.entries[key]["prepared"])) == expected, key
+        if expected[0]: matched += 1
+    assert matched > len(packages) // 4
+
+def test_edge_cases():
+    available_files = {name: f"/res/{name}.png" for name in ["ic_firefox", "firefox_nightly", "fire", "gimp", "gnu_image_manipulation", "x"]}
+    index = MatchIndex(available_files)
+    for wanted in [["firefox"], ["fire"], ["gim"], ["gnu-image-manipulation"], ["x"], ["nothing"], ["firefox", "x"], [""]]:
+        assert accepted(index.best_match(wanted)) == accepted(full_scan(available_files, wanted)), wanted
+    assert MatchIndex({}).best_match(["firefox"]) == (None, 0)
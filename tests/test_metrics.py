@@ -0,0 +1,35 @@
+import time
+
+from metrics import ConversionMetrics, RssSampler, peak_rss_kb_by_process
+from transcode import encoder_pool
+
+ALLOCATION_KB = 200 * 1024
+
+def hold_memory(seconds):
+    # Touches every page so it is resident, not just reserved.
+    block = bytearray(ALLOCATION_KB * 1024)
+    for i in range(0, len(block), 4096): block[i] = 1
+    time.sleep(seconds)
+    return len(block)
+
+def test_sampler_sees_pool_workers():
+    # Pool workers are forked by the fork server, so they are grandchildren.
+    pool = encoder_pool(2)
+    try:
+        pool.submit(time.sleep, 0).result()
+        with RssSampler() as idle: time.sleep(0.3)
+        with RssSampler() as busy:
+            futures = [pool.submit(hold_memory, 1.0) for i in range(2)]
+            for future in futures: future.result()
+    finally:
+        pool.shutdown()
+    assert busy.peak_kb - idle.peak_kb > 1.5 * ALLOCATION_KB
+
+def test_worker_rss_in_peak():
+    metrics = ConversionMetrics()
+    stats = {"decoded": 1, "passthrough": 0, "scaled": 0, "bytes": 0, "encode_time": 0.0}
+    metrics.add_encode_stats(dict(stats, rss_kb=5000))
+    metrics.add_encode_stats(dict(stats, rss_kb=10 ** 9))
+    metrics.add_encode_stats(stats)
+    assert metrics.worker_rss_kb == 10 ** 9
+    assert peak_rss_kb_by_process(metrics.worker_rss_kb)["children"] == 10 ** 9
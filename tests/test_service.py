@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from conftest import SRC_DIR
+import service
+from mappingdb import default_config_dir
+
+def test_config_dir_is_next_to_the_modules():
+    assert os.path.isfile(os.path.join(default_config_dir(), "mappings.json"))
+
+def test_job_options_rejects_bad_input(synthetic_apk):
+    with pytest.raises(service.ServiceError) as e:
+        service.job_options(synthetic_apk, {"colour": "red"})
+    assert e.value.name == "InvalidOption"
+    with pytest.raises(service.ServiceError) as e:
+        service.job_options(synthetic_apk, {"link_mode": "reflink"})
+    assert e.value.name == "InvalidOption"
+    with pytest.raises(service.ServiceError) as e:
+        service.job_options(synthetic_apk + ".missing", {})
+    assert e.value.name == "NotFound"
+
+def test_service_runs_a_job(synthetic_apk, tmp_path):
+    finished = threading.Event()
+    svc = service.ConversionService(default_config_dir(), on_finished=lambda job: finished.set())
+    job_id = svc.submit(synthetic_apk, {"output": str(tmp_path), "theme": "Synthetic", "workers": 1})
+    assert svc.list_jobs() == [job_id]
+    assert finished.wait(120)
+    status = svc.status(job_id)
+    assert status["state"] == "done", status["error"]
+    assert os.path.isfile(os.path.join(tmp_path, "Synthetic", "index.theme"))
+    assert not svc.cancel(job_id)
+
+# The D-Bus test starts a private dbus-daemon with GTestDBus, so it never
+# touches the session bus. It needs PyGObject and dbus-daemon.
+
+def wait_for_name(connection, name, timeout=30):
+    from gi.repository import GLib
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        reply = connection.call_sync("org.freedesktop.DBus", "/org/freedesktop/DBus", "org.freedesktop.DBus",
+                                     "NameHasOwner", GLib.Variant("(s)", (name,)), None, 0, -1, None)
+        if reply.unpack()[0]: return True
+        time.sleep(0.1)
+    return False
+
+def test_service_on_private_bus(synthetic_apk, tmp_path):
+    pytest.importorskip("gi")
+    from gi.repository import Gio, GLib
+    bus = Gio.TestDBus.new(Gio.TestDBusFlags.NONE)
+    bus.up()
+    process = None
+    try:
+        env = dict(os.environ, DBUS_SESSION_BUS_ADDRESS=bus.get_bus_address())
+        process = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, "service.py")], env=env)
+        connection = Gio.DBusConnection.new_for_address_sync(
+            bus.get_bus_address(),
+            Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION,
+            None, None)
+        assert wait_for_name(connection, service.BUS_NAME)
+
+        def call(method, args, reply_type):
+            return connection.call_sync(service.BUS_NAME, service.OBJECT_PATH, service.INTERFACE_NAME, method,
+                                        args, GLib.VariantType(reply_type), 0, -1, None).unpack()
+
+        options = {"output": GLib.Variant("s", str(tmp_path)), "theme": GLib.Variant("s", "Synthetic")}
+        job_id = call("Submit", GLib.Variant("(sa{sv})", (synthetic_apk, options)), "(s)")[0]
+        assert call("ListJobs", None, "(as)")[0] == [job_id]
+
+        with pytest.raises(GLib.Error) as e:
+            call("Submit", GLib.Variant("(sa{sv})", (synthetic_apk + ".missing", {})), "(s)")
+        assert f"{service.ERROR_PREFIX}.NotFound" in e.value.message
+
+        deadline = time.monotonic() + 120
+        status = {}
+        while time.monotonic() < deadline:
+            status = call("GetStatus", GLib.Variant("(s)", (job_id,)), "(a{sv})")[0]
+            if status["state"] not in ("queued", "running"): break
+            time.sleep(0.2)
+        assert status["state"] == "done", status.get("error")
+        assert os.path.isfile(os.path.join(tmp_path, "Synthetic", "index.theme"))
+    finally:
+        if process:
+            process.terminate()
+            process.wait(10)
+        bus.down()
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+from PIL import Image
+
+import converter
+from mappingdb import load_mapping_db, default_config_dir
+from sync import ThemeSync, MANIFEST_NAME, load_manifest
+from transcode import make_job, run_plan
+
+@pytest.fixture
+def theme(tmp_path):
+    sources = {}
+    for name, color in [("a", "red"), ("b", "blue")]:
+        path = str(tmp_path / f"{name}.png")
+        Image.new("RGBA", (64, 64), color).save(path)
+        sources[name] = path
+    root = tmp_path / "theme"
+    folder = root / "apps" / "512x512"
+    folder.mkdir(parents=True)
+    return str(root), str(folder), sources
+
+def sync(root, plan, fingerprints, link_mode="symlink"):
+    theme_sync = ThemeSync(root)
+    jobs, relinks = theme_sync.plan(plan, fingerprints, "default", link_mode)
+    written, failures = run_plan(jobs, 1, link_mode)
+    failures += theme_sync.relink(relinks, link_mode)
+    theme_sync.commit(failures)
+    return jobs, theme_sync.stats
+
+def test_change_detection(theme):
+    root, folder, sources = theme
+    plan = [make_job(sources["a"], folder, ["a", "a_alt"]), make_job(sources["b"], folder, ["b"])]
+    fingerprints = {sources["a"]: "a1", sources["b"]: "b1"}
+
+    jobs, stats = sync(root, plan, fingerprints)
+    assert len(jobs) == 2 and stats["written"] == 3
+    assert set(load_manifest(root)) == {"apps/512x512/a.png", "apps/512x512/a_alt.png", "apps/512x512/b.png"}
+
+    jobs, stats = sync(root, plan, fingerprints)
+    assert jobs == [] and stats == {"unchanged": 3, "written": 0, "relinked": 0, "removed": 0}
+
+    # A changed source fingerprint rewrites only that job.
+    jobs, stats = sync(root, plan, dict(fingerprints, **{sources["b"]: "b2"}))
+    assert [job[2] for job in jobs] == [["b"]]
+
+    # So does a file edited behind Isomorphicon's back.
+    with open(os.path.join(folder, "b.png"), "ab") as f: f.write(b"\0")
+    jobs, stats = sync(root, plan, dict(fingerprints, **{sources["b"]: "b2"}))
+    assert [job[2] for job in jobs] == [["b"]]
+
+    # A missing extra name is only linked again.
+    os.unlink(os.path.join(folder, "a_alt.png"))
+    jobs, stats = sync(root, plan, dict(fingerprints, **{sources["b"]: "b2"}))
+    assert jobs == [] and stats["relinked"] == 1
+    assert os.path.islink(os.path.join(folder, "a_alt.png"))
+
+def test_settings_change_rewrites(theme):
+    root, folder, sources = theme
+    plan = [make_job(sources["a"], folder, ["a"])]
+    fingerprints = {sources["a"]: "a1"}
+    sync(root, plan, fingerprints)
+    jobs, stats = sync(root, [make_job(sources["a"], folder, ["a"], normalize=False)], fingerprints)
+    assert len(jobs) == 1
+
+def test_removed_targets_are_deleted_but_foreign_files_kept(theme):
+    root, folder, sources = theme
+    fingerprints = {sources["a"]: "a1", sources["b"]: "b1"}
+    sync(root, [make_job(sources["a"], folder, ["a"]), make_job(sources["b"], folder, ["b"])], fingerprints)
+    foreign = os.path.join(folder, "mine.png")
+    with open(foreign, "wb") as f: f.write(b"not ours")
+
+    jobs, stats = sync(root, [make_job(sources["a"], folder, ["a"])], fingerprints)
+    assert jobs == [] and stats["removed"] == 1
+    assert not os.path.exists(os.path.join(folder, "b.png"))
+    assert os.path.exists(foreign)
+    assert set(load_manifest(root)) == {"apps/512x512/a.png"}
+
+def test_abort_forgets_pending_targets(theme):
+    root, folder, sources = theme
+    plan = [make_job(sources["a"], folder, ["a"])]
+    sync(root, plan, {sources["a"]: "a1"})
+    theme_sync = ThemeSync(root)
+    jobs, relinks = theme_sync.plan(plan, {sources["a"]: "a2"}, "default", "symlink")
+    theme_sync.abort()
+    assert load_manifest(root) == {}
+    assert os.path.exists(os.path.join(root, MANIFEST_NAME))
+
+def test_convert_sync_twice(synthetic_apk, tmp_path):
+    db = load_mapping_db(default_config_dir())
+    args = (synthetic_apk, db.mappings, db.synonyms, str(tmp_path), "Synthetic", "hicolor")
+    result, metrics = converter.convert_apk(*args, workers=1, mapping_db=db, sync=True)
+    assert result and metrics.sync["written"] > 0
+    result, metrics = converter.convert_apk(*args, workers=1, mapping_db=db, sync=True)
+    assert metrics.sync["written"] == 0 and metrics.sync["removed"] == 0
+    assert metrics.sync["unchanged"] > 0
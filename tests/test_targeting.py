@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import targeting
+from transcode import make_job
+
+def write_desktop(data_dir, rel, text):
+    path = os.path.join(data_dir, "applications", rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f: f.write(text)
+
+def entry(icon=None, extra=""):
+    text = "[Desktop Entry]\nType=Application\nName=App\n"
+    if icon: text += f"Icon={icon}\n"
+    return text + extra
+
+@pytest.fixture
+def xdg(tmp_path, monkeypatch):
+    home = tmp_path / "home"
+    system = [tmp_path / "local", tmp_path / "usr"]
+    monkeypatch.setattr(targeting, "in_flatpak", lambda: False)
+    monkeypatch.setattr(targeting, "FLATPAK_EXPORTS", str(tmp_path / "flatpak"))
+    monkeypatch.setenv("XDG_DATA_HOME", str(home))
+    monkeypatch.setenv("XDG_DATA_DIRS", ":".join(str(d) for d in system))
+    return str(home), [str(d) for d in system], str(tmp_path / "flatpak")
+
+def test_data_dirs_order(xdg):
+    home, system, flatpak = xdg
+    assert targeting.data_dirs() == [home] + system + [os.path.join(home, "flatpak", "exports", "share"), flatpak]
+
+def test_installed_icon_names(xdg):
+    home, (local, usr), flatpak = xdg
+    write_desktop(usr, "firefox.desktop", entry("firefox"))
+    # The user's copy shadows the system one.
+    write_desktop(usr, "editor.desktop", entry("system-editor"))
+    write_desktop(home, "editor.desktop", entry("my-editor"))
+    # Hidden removes the application, also from later data dirs.
+    write_desktop(home, "spam.desktop", entry("spam", "Hidden=true\n"))
+    write_desktop(usr, "spam.desktop", entry("spam"))
+    write_desktop(local, "photos.desktop", entry("photos.svg"))
+    write_desktop(local, "script.desktop", entry("/opt/script/icon.png"))
+    write_desktop(usr, "term.desktop", entry("terminal", "StartupWMClass=XTerm\n"))
+    write_desktop(usr, "actions.desktop", entry("main", "\n[Desktop Action new]\nName=New\nIcon=main-new\n"))
+    # Desktop ids of files in subfolders join the path with dashes.
+    write_desktop(local, "kde4/kate.desktop", entry("kate"))
+    write_desktop(usr, "kde4-kate.desktop", entry("other-kate"))
+    write_desktop(flatpak, "org.gimp.GIMP.desktop", entry("org.gimp.GIMP"))
+    write_desktop(usr, "notes.txt", entry("not-a-desktop-file"))
+
+    names = targeting.installed_icon_names()
+    assert names == {"firefox", "my-editor", "photos", "terminal", "XTerm", "xterm", "main", "main-new", "kate", "org.gimp.GIMP"}
+
+def test_icon_names():
+    assert targeting.icon_names("Icon", "gimp.png") == {"gimp"}
+    assert targeting.icon_names("Icon", "org.gnome.Maps") == {"org.gnome.Maps"}
+    assert targeting.icon_names("Icon", "/usr/share/pixmaps/x.png") == set()
+    assert targeting.icon_names("StartupWMClass", "Gimp-2.10") == {"Gimp-2.10", "gimp-2.10"}
+
+def test_prune_jobs():
+    jobs = [make_job("/res/a.png", "/t/apps", ["firefox", "firefox-esr"]), make_job("/res/b.png", "/t/apps", ["unused"])]
+    assert targeting.prune_jobs(jobs, {"firefox"}) == [make_job("/res/a.png", "/t/apps", ["firefox"])]
+
+def test_prune_matches():
+    matches = [
+        {"phase": "XML_MATCH", "drawable": "a", "targets": ["firefox", "firefox-esr"]},
+        {"phase": "SCORED_MATCH", "drawable": "b", "targets": ["unused"]},
+        {"phase": "FAILED", "drawable": None, "targets": ["unused"]}
+    ]
+    assert targeting.prune_matches(matches, {"firefox"}) == [
+        {"phase": "XML_MATCH", "drawable": "a", "targets": ["firefox"]},
+        {"phase": "FAILED", "drawable": None, "targets": ["unused"]}
+    ]
+
+def test_convert_installed_apps_only(synthetic_apk, tmp_path, capsys):
+    import converter
+    from mappingdb import load_mapping_db, default_config_dir
+    db = load_mapping_db(default_config_dir())
+    args = (synthetic_apk, db.mappings, db.synonyms, str(tmp_path), "Synthetic", "hicolor")
+    result, metrics = converter.convert_apk(*args, workers=1, mapping_db=db)
+    assert metrics.wanted_names is None and "installed apps" not in capsys.readouterr().out
+    everything = {os.path.splitext(f)[0] for f in os.listdir(os.path.join(result, "apps", "512x512"))}
+
+    wanted = set(sorted(everything)[:5]) | {"not-in-this-pack"}
+    result, metrics = converter.convert_apk(*args, workers=1, mapping_db=db, wanted=wanted)
+    assert metrics.wanted_names == 6 and "installed apps" in capsys.readouterr().out
+    assert {os.path.splitext(f)[0] for f in os.listdir(os.path.join(result, "apps", "512x512"))} == wanted & everything